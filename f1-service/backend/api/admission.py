@@ -0,0 +1,179 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from .concurrency import F1_LOAD_WORKERS
+from .instrumentation import phase
+
+# Admission Configuration, by default one cold load per load thread
+F1_MAX_COLD_LOADS = int(os.getenv('F1_MAX_COLD_LOADS', str(F1_LOAD_WORKERS)))
+F1_LOAD_QUEUE_SIZE = int(os.getenv('F1_LOAD_QUEUE_SIZE', '32'))
+F1_LOAD_QUEUE_TIMEOUT_SECONDS = float(os.getenv('F1_LOAD_QUEUE_TIMEOUT_SECONDS', '10'))
+
+# Lower runs first. Pages need the schedule before anything else, whole-season work can wait.
+# Cached responses and health checks never reach the queue.
+ENDPOINT_PRIORITIES = {
+    '/api/schedule': 0,
+    '/api/session-info': 1,
+    '/api/weekend-results': 1,
+    '/api/season-standings': 2,
+}
+DEFAULT_PRIORITY = 1
+
+# Weight of the newest sample in each endpoint's moving average of load times
+LOAD_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """A cold load was shed instead of queued, retry_after is the suggested wait in seconds"""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Service is busy loading data, try again shortly")
+        self.retry_after = retry_after
+
+
+def priority_for(endpoint: str) -> int:
+    return ENDPOINT_PRIORITIES.get(endpoint, DEFAULT_PRIORITY)
+
+
+class AdmissionController:
+    """Limits concurrent cold loads, queueing the rest by priority up to a deadline.
+
+    Requests are shed right away when the queue is full or when the expected wait
+    already exceeds the deadline, so overload turns into quick 503s instead of
+    every request slowing down together. Load times are tracked per endpoint, so a
+    queue of cheap schedule loads is not judged by the last whole-season load.
+    """
+
+    def __init__(self, max_concurrent: int = F1_MAX_COLD_LOADS, max_queued: int = F1_LOAD_QUEUE_SIZE,
+                 queue_timeout: float = F1_LOAD_QUEUE_TIMEOUT_SECONDS) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, str]] = []
+        self._sequence = itertools.count()
+        # Endpoint and start time of each load holding a slot
+        self._running: Dict[int, Tuple[str, float]] = {}
+        self.avg_load_seconds: Dict[str, float] = {}
+        self.admitted = 0
+        self.queued_total = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+        self.timed_out = 0
+        self.max_queue_length = 0
+
+    @property
+    def queue_length(self) -> int:
+        return sum(1 for _, _, waiter, _ in self._waiters if not waiter.done())
+
+    def _estimate(self, endpoint: str) -> float:
+        """Expected load time of an endpoint, the mean of the others until it has been timed"""
+        if endpoint in self.avg_load_seconds:
+            return self.avg_load_seconds[endpoint]
+        if not self.avg_load_seconds:
+            return 0.0
+        return sum(self.avg_load_seconds.values()) / len(self.avg_load_seconds)
+
+    def _expected_wait(self, ahead: List[str]) -> float:
+        """Rough wait behind what is left of the running loads and the queued loads of the
+        `ahead` endpoints, spread over the slots, 0 until loads are timed"""
+        now = time.perf_counter()
+        work = sum(max(0.0, self._estimate(endpoint) - (now - start)) for endpoint, start in self._running.values())
+        work += sum(self._estimate(endpoint) for endpoint in ahead)
+        return work / self.max_concurrent
+
+    def _queued_ahead(self, priority: int) -> List[str]:
+        return [e for p, _, waiter, e in self._waiters if p <= priority and not waiter.done()]
+
+    def _retry_after(self) -> int:
+        queued = [e for _, _, waiter, e in self._waiters if not waiter.done()]
+        return max(1, math.ceil(self._expected_wait(queued)))
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str) -> AsyncIterator[None]:
+        """Hold one of the cold load slots for an endpoint's load, raising Overloaded when the request is shed"""
+        with phase('queue_wait'):
+            await self._acquire(endpoint)
+        start = time.perf_counter()
+        token = next(self._sequence)
+        self._running[token] = (endpoint, start)
+        try:
+            yield
+        finally:
+            del self._running[token]
+            self._record(endpoint, time.perf_counter() - start)
+            self._release()
+
+    async def _acquire(self, endpoint: str) -> None:
+        priority = priority_for(endpoint)
+        if self._active < self.max_concurrent and self.queue_length == 0:
+            self._active += 1
+            self.admitted += 1
+            return
+
+        queue_length = self.queue_length
+        if queue_length >= self.max_queued:
+            self.shed_queue_full += 1
+            raise Overloaded(self._retry_after())
+
+        if self._expected_wait(self._queued_ahead(priority)) > self.queue_timeout:
+            self.shed_deadline += 1
+            raise Overloaded(self._retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter, endpoint))
+        self.queued_total += 1
+        self.max_queue_length = max(self.max_queue_length, queue_length + 1)
+
+        try:
+            # The slot is handed over by _release, _active already counts it
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise Overloaded(self._retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        self.admitted += 1
+
+    def _release(self) -> None:
+        """Hand the slot to the highest priority waiter still waiting, or free it"""
+        while self._waiters:
+            _, _, waiter, _ = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def _record(self, endpoint: str, seconds: float) -> None:
+        average = self.avg_load_seconds.get(endpoint)
+        if average is None:
+            self.avg_load_seconds[endpoint] = seconds
+        else:
+            self.avg_load_seconds[endpoint] = average + LOAD_TIME_SMOOTHING * (seconds - average)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self._active,
+            "queue_length": self.queue_length,
+            "max_queue_length": self.max_queue_length,
+            "queue_capacity": self.max_queued,
+            "queue_timeout_seconds": self.queue_timeout,
+            "admitted": self.admitted,
+            "queued": self.queued_total,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_deadline": self.shed_deadline,
+            "timed_out": self.timed_out,
+            "avg_load_ms": {endpoint: round(seconds * 1000, 2) for endpoint, seconds in self.avg_load_seconds.items()},
+        }
+
+
+# Global admission controller
+admission = AdmissionController()
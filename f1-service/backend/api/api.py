@@ -1,23 +1,40 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from typing import Optional
 from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from .models import ScheduleResponse, SessionResponse, StandingsResponse
 import uvicorn
-import fastf1
-import json
-import time
-from .utils import aggregate_weekend, usage_tracking_middleware
+from .utils import session_executor
 from .kafka_producer import kafka_producer
+from .cache import data_cache, response_cache
+from .concurrency import load_executor, run_warm, single_flight, warm_executor
+from .loaders import (
+    InvalidFieldsError, get_cached_response, parse_fields,
+    SCHEDULE, SEASON_STANDINGS, SESSION_INFO, WEEKEND_RESULTS,
+)
+from .models import ScheduleResponse, SessionResponse, StandingsResponse, SessionBatchRequest, SessionBatchResponse
+from .batch import BATCH_MAX_SESSIONS, get_session_batch
+from .http_cache import cached_json_response
+from .admission import Overloaded, admission
+from .warmup import cache_warmer, cache_size_bytes
+from .result_store import result_store
+from .shared_cache import shared_cache
+from .instrumentation import instrumentation_middleware, request_metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("F1 Service starting up...")
-    kafka_producer.__init__()
+    kafka_producer.start()
+    cache_warmer.start()
 
     yield
     # Shutdown
     print("F1 Service shutting down...")
+    await cache_warmer.stop()
+    load_executor.shutdown(wait=False, cancel_futures=True)
+    warm_executor.shutdown(wait=False, cancel_futures=True)
+    session_executor.shutdown(wait=False, cancel_futures=True)
     kafka_producer.close()
 
 app = FastAPI(title="F1 Service API", version="0.1", lifespan=lifespan)
@@ -30,133 +47,142 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.middleware("http")(usage_tracking_middleware)
-app.middleware("https")(usage_tracking_middleware)
-
-# Routes
-
-@app.get("/api/session-info")
-async def get_session_info(year: int, round: int | str, sessionCd: str):
+# One usage event and one histogram sample per request
+app.middleware("http")(instrumentation_middleware)
 
-    try:
-        start = time.perf_counter()
-        # Get session info
-        session = fastf1.get_session(year, round, sessionCd)
+def overloaded_error(e: Overloaded) -> HTTPException:
+    """Shed requests fail fast and tell the client when to come back"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-        # Minimize Data Sent
-        session.load(telemetry=False, weather=False, messages=False, livedata=False)
-        results = session.results
-        session_json = results.to_json(orient='records', date_format='iso')
-        session_data = json.loads(session_json)
+def json_response(body: bytes) -> Response:
+    """Wrap an already serialized JSON body in a response"""
+    return Response(content=body, media_type="application/json")
 
-        end = time.perf_counter()
+# Routes
 
-        # Multiply by 1000 to convert to milliseconds
-        response_time = (end - start) * 1000
+@app.get("/api/session-info", responses={200: {"model": SessionResponse}})
+async def get_session_info(request: Request, year: int, round: int | str, sessionCd: str, fields: Optional[str] = None):
+    """Get session results, optionally only the comma separated columns in fields"""
+    try:
+        columns = parse_fields(fields)
+        cache_key = ("/api/session-info", year, str(round), sessionCd, columns)
+        response = await get_cached_response(cache_key, SESSION_INFO, year, round, sessionCd)
+        return cached_json_response(request, response)
 
-        kafka_producer.send_usage_event(
-            endpoint="/api/session-info",
-            method="GET",
-            status_code=200,
-            response_time=response_time,
-            user_agent=None,
-            query_params={"year": year, "round": round, "sessionCd": sessionCd}
-        )
+    except InvalidFieldsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        return SessionResponse(status=200, session=session_data)
+    except Overloaded as e:
+        raise overloaded_error(e)
 
     except Exception as e:
-
-        kafka_producer.send_usage_event(
-            endpoint="/api/session-info",
-            method="GET",
-            status_code=500,
-            response_time=-1,
-            user_agent=None,
-            query_params={"year": year, "round": round, "sessionCd": sessionCd}
-        )
-
         raise HTTPException(status_code=500, detail=f"Error retrieving session info: {e}")
-    
 
-@app.get("/api/weekend-results")
-async def get_weekend_results(year: int, round: int | str):
+
+@app.get("/api/weekend-results", responses={200: {"model": StandingsResponse}})
+async def get_weekend_results(request: Request, year: int, round: int | str, fields: Optional[str] = None):
     """Get F1 weekend results for a specific year and round"""
     try:
-        start = time.perf_counter()
-
-        result = aggregate_weekend(year, round)
-        weekend_json = result.to_json(orient='records', date_format='iso')
-        weekend_data = json.loads(weekend_json)
+        columns = parse_fields(fields)
+        cache_key = ("/api/weekend-results", year, str(round), None, columns)
+        response = await get_cached_response(cache_key, WEEKEND_RESULTS, year, round)
+        return cached_json_response(request, response)
 
-        end = time.perf_counter()
+    except InvalidFieldsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Multiply by 1000 to convert to milliseconds
-        response_time = (end - start) * 1000  
+    except Overloaded as e:
+        raise overloaded_error(e)
 
-        kafka_producer.send_usage_event(
-            endpoint="/api/weekend-results",
-            method="GET",
-            status_code=200,
-            response_time=response_time,
-            user_agent=None,
-            query_params={"year": year, "round": round}
-        )
-
-        return StandingsResponse(status=200, standings=weekend_data)
-    
     except Exception as e:
-
-        kafka_producer.send_usage_event(
-            endpoint="/api/session-info",
-            method="GET",
-            status_code=500,
-            response_time=-1,
-            user_agent=None,
-            query_params={"year": year, "round": round}
-        )
-
         raise HTTPException(status_code=500, detail=f"Error retrieving weekend results: {e}")
 
 
-@app.get("/api/schedule")
-async def get_schedule(year: int):
+@app.get("/api/schedule", responses={200: {"model": ScheduleResponse}})
+async def get_schedule(request: Request, year: int, fields: Optional[str] = None):
     """Get F1 schedule for a specific year"""
     try:
-        start = time.perf_counter()
-
-        schedule = fastf1.get_event_schedule(year)
-        schedule_json = schedule.to_json(orient='records', date_format='iso')
-        schedule_data = json.loads(schedule_json)
-
-        end = time.perf_counter()
+        columns = parse_fields(fields)
+        cache_key = ("/api/schedule", year, None, None, columns)
+        response = await get_cached_response(cache_key, SCHEDULE, year)
+        return cached_json_response(request, response)
 
-        # Multiply by 1000 to convert to milliseconds
-        response_time = (end - start) * 1000
+    except InvalidFieldsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        kafka_producer.send_usage_event(
-            endpoint="/api/schedule",
-            method="GET",
-            status_code=200,
-            response_time=response_time,
-            user_agent=None,
-            query_params={"year": year}
-        )
+    except Overloaded as e:
+        raise overloaded_error(e)
 
-        return ScheduleResponse(status=200, schedule=schedule_data)
-    
     except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving schedule: {e}")
 
-        kafka_producer.send_usage_event(
-            endpoint="/api/schedule",
-            method="GET",
-            status_code=500,
-            response_time=-1,
-            user_agent=None,
-            query_params={"year": year}
-        )
+@app.get("/api/season-standings")
+async def get_season_standings(request: Request, year: int):
+    """Get driver and constructor championship standings and their progression for a season"""
+    try:
+        cache_key = ("/api/season-standings", year, None, None, None)
+        response = await get_cached_response(cache_key, SEASON_STANDINGS, year)
+        return cached_json_response(request, response)
 
-        raise HTTPException(status_code=500, detail=f"Error retrieving schedule: {e}")
+    except Overloaded as e:
+        raise overloaded_error(e)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving season standings: {e}")
+
+@app.post("/api/sessions/batch", responses={200: {"model": SessionBatchResponse}})
+async def get_sessions_batch(batch: SessionBatchRequest):
+    """Get results for several sessions at once, each item carrying its own status"""
+    if len(batch.sessions) > BATCH_MAX_SESSIONS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {BATCH_MAX_SESSIONS} sessions")
+
+    body = await get_session_batch(batch.sessions, parse_fields(batch.fields))
+    return json_response(body)
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Get hit/miss/eviction counters for the response cache"""
+    return {
+        **response_cache.stats(),
+        "data": data_cache.stats(),
+        "loads": single_flight.stats(),
+        "result_store": result_store.stats(),
+        "shared": shared_cache.stats() if shared_cache is not None else {"enabled": False},
+    }
+
+@app.get("/api/cache/fastf1")
+async def fastf1_cache_status():
+    """Get warm-up progress, the next scheduled prefetch and the size of the FastF1 disk cache"""
+    return {**cache_warmer.stats(), "size_bytes": await run_warm(cache_size_bytes)}
+
+@app.get("/api/telemetry/admission")
+async def admission_stats():
+    """Get active cold loads, queue length and shed counts for admission control"""
+    return admission.stats()
+
+@app.get("/api/telemetry/producer")
+async def producer_stats():
+    """Get queue depth, drop counts and flush latency for the usage event producer"""
+    return kafka_producer.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus exposition of request latency and phase histograms plus cache, admission and producer gauges"""
+    cache = response_cache.stats()
+    load_admission = admission.stats()
+    producer = kafka_producer.stats()
+    gauges = {
+        "f1_response_cache_entries": cache["entries"],
+        "f1_response_cache_hits_total": cache["hits"],
+        "f1_response_cache_misses_total": cache["misses"],
+        "f1_admission_active_loads": load_admission["active"],
+        "f1_admission_queue_length": load_admission["queue_length"],
+        "f1_admission_shed_total": load_admission["shed_queue_full"] + load_admission["shed_deadline"] + load_admission["timed_out"],
+        "f1_producer_queue_depth": producer["queue_depth"],
+        "f1_producer_dropped_total": sum(producer["dropped"].values()),
+    }
+    lines = [f"{name} {value}" for name, value in gauges.items()]
+    return PlainTextResponse(request_metrics.render() + "\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 @app.get("/api/health")
 async def health_check():
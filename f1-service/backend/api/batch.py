@@ -0,0 +1,58 @@
+from typing import Dict, Hashable, List
+import asyncio
+import json
+import os
+from .loaders import SESSION_INFO, Fields, InvalidFieldsError, get_cached_response
+from .models import SessionRequest
+from .admission import Overloaded
+
+# Batch Configuration
+BATCH_MAX_SESSIONS = int(os.getenv('BATCH_MAX_SESSIONS', '50'))
+# Uncached sessions of one batch loaded at the same time
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+
+def session_cache_key(request: SessionRequest, fields: Fields) -> Hashable:
+    """Same key as /api/session-info, so batch and single requests share cache entries"""
+    return ("/api/session-info", request.year, str(request.round), request.sessionCd, fields)
+
+
+def error_body(status_code: int, detail: str) -> bytes:
+    return json.dumps({"status": status_code, "detail": detail}).encode()
+
+
+async def get_session_batch(sessions: List[SessionRequest], fields: Fields) -> bytes:
+    """Load every session of a batch, reporting failures per item instead of failing the batch"""
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def load(request: SessionRequest) -> bytes:
+        async with semaphore:
+            try:
+                response = await get_cached_response(
+                    session_cache_key(request, fields), SESSION_INFO,
+                    request.year, request.round, request.sessionCd,
+                )
+                return response.body
+            except InvalidFieldsError as e:
+                return error_body(400, str(e))
+            except Overloaded as e:
+                return error_body(503, str(e))
+            except Exception as e:
+                return error_body(500, f"Error retrieving session info: {e}")
+
+    # Duplicate sessions within the batch are loaded once
+    tasks: Dict[Hashable, asyncio.Task] = {}
+    for request in sessions:
+        key = session_cache_key(request, fields)
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(load(request))
+    await asyncio.gather(*tasks.values())
+
+    # Each cached body already is {"status": ..., "session": [...]}, embed it as is
+    items = []
+    for request in sessions:
+        body = tasks[session_cache_key(request, fields)].result()
+        echo = json.dumps({"year": request.year, "round": request.round, "sessionCd": request.sessionCd})
+        items.append(echo[:-1].encode() + b',"result":' + body + b'}')
+
+    return b'{"status":200,"results":[' + b','.join(items) + b']}'
@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Hashable, Optional
+import gzip
+import hashlib
+import os
+import threading
+import time
+from .instrumentation import phase
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses are then only gzipped
+    brotli = None
+
+# Cache Configuration
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+# Loaded data behind the responses, every fields= projection of it is built from one entry
+DATA_CACHE_MAX_ENTRIES = int(os.getenv('DATA_CACHE_MAX_ENTRIES', '128'))
+RESPONSE_CACHE_LIVE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_LIVE_TTL_SECONDS', '60'))
+
+# Results can still be amended by stewards for a while after a session ends
+RESULTS_SETTLE_TIME = timedelta(hours=int(os.getenv('RESULTS_SETTLE_HOURS', '24')))
+
+# Historical data never changes, so it only leaves the cache through LRU eviction
+HISTORICAL_TTL_SECONDS = float('inf')
+
+# Smaller bodies are not worth the Content-Encoding overhead
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """A serialized body with its ETag and precompressed variants, built once per cache fill"""
+    body: bytes
+    ttl: float
+    etag: str
+    gzip: Optional[bytes] = None
+    br: Optional[bytes] = None
+
+    @classmethod
+    def build(cls, body: bytes, ttl: float) -> "CachedResponse":
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        if len(body) < COMPRESS_MIN_BYTES:
+            return cls(body=body, ttl=ttl, etag=etag)
+
+        with phase('compress'):
+            return cls(
+                body=body,
+                ttl=ttl,
+                etag=etag,
+                gzip=gzip.compress(body, compresslevel=9, mtime=0),
+                br=brotli.compress(body, quality=9) if brotli is not None else None,
+            )
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip or b'') + len(self.br or b'')
+
+
+@dataclass
+class CacheEntry:
+    response: CachedResponse
+    expires_at: float
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of serialized responses, or of the data they are built from, with per-entry TTLs."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """Return the cached response for a key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.response
+
+    def put(self, key: Hashable, response: CachedResponse, ttl_seconds: float) -> None:
+        """Store a response, evicting the least recently used entries past capacity"""
+        with self._lock:
+            self._entries[key] = CacheEntry(response=response, expires_at=time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": sum(e.response.size for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+            }
+
+
+def ttl_for(session_start: Optional[datetime]) -> float:
+    """Pick a TTL based on whether a session is settled history or still live/upcoming"""
+    if session_start is None:
+        return RESPONSE_CACHE_LIVE_TTL_SECONDS
+
+    if session_start.tzinfo is not None:
+        session_start = session_start.replace(tzinfo=None) - session_start.utcoffset()
+
+    if datetime.utcnow() > session_start + RESULTS_SETTLE_TIME:
+        return HISTORICAL_TTL_SECONDS
+
+    return RESPONSE_CACHE_LIVE_TTL_SECONDS
+
+
+def ttl_for_season(year: int) -> float:
+    """Past seasons are final, the current season's schedule can still change"""
+    if year < datetime.utcnow().year:
+        return HISTORICAL_TTL_SECONDS
+
+    return RESPONSE_CACHE_LIVE_TTL_SECONDS
+
+
+# Global cache instances
+response_cache = ResponseCache()
+data_cache = ResponseCache(max_entries=DATA_CACHE_MAX_ENTRIES)
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# FastF1 loads are blocking and mostly network/disk bound, so a small thread pool keeps
+# them off the event loop without letting a burst of cold requests spawn unbounded work
+F1_LOAD_WORKERS = int(os.getenv('F1_LOAD_WORKERS', '4'))
+
+load_executor = ThreadPoolExecutor(max_workers=F1_LOAD_WORKERS, thread_name_prefix='fastf1-load')
+
+# Cache reads and response serialization get their own pool, so a hit never waits for
+# a thread behind cold loads, warm-up loads or workers blocked on a shared cache lock
+F1_WARM_WORKERS = int(os.getenv('F1_WARM_WORKERS', '4'))
+warm_executor = ThreadPoolExecutor(max_workers=F1_WARM_WORKERS, thread_name_prefix='warm-read')
+
+
+async def _run_in(executor: ThreadPoolExecutor, func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking function on a pool, in the caller's context like asyncio.to_thread"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args))
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking FastF1 load on the bounded load pool"""
+    return await _run_in(load_executor, func, *args)
+
+
+async def run_warm(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking cache read or serialization on the warm pool"""
+    return await _run_in(warm_executor, func, *args)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single in-flight task."""
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Await the in-flight task for a key, starting one if there is none"""
+        task = self._inflight.get(key)
+
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._finished, key))
+        else:
+            self.coalesced += 1
+
+        # Shield so one disconnecting client does not cancel the load for everyone else
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+        # Mark the exception as retrieved in case every waiter was cancelled
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Load for {key} failed: {task.exception()}")
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+# Global single-flight group for FastF1 loads
+single_flight = SingleFlight()
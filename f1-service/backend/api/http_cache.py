@@ -0,0 +1,70 @@
+from typing import Optional
+from fastapi import Request, Response
+import os
+from .cache import HISTORICAL_TTL_SECONDS, CachedResponse
+
+# Browser and proxy lifetime for settled results, revalidated with If-None-Match afterwards
+HISTORICAL_MAX_AGE_SECONDS = int(os.getenv('HISTORICAL_MAX_AGE_SECONDS', '86400'))
+
+
+def cache_control(ttl: float) -> str:
+    if ttl == HISTORICAL_TTL_SECONDS:
+        return f"public, max-age={HISTORICAL_MAX_AGE_SECONDS}"
+    return f"public, max-age={int(ttl)}, must-revalidate"
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """Content codings the client accepts, ignoring any it refuses with q=0"""
+    encodings = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        params = params.strip().lower()
+        try:
+            q = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            q = 0.0
+        if coding.strip() and q > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as required for If-None-Match, ignoring the per-encoding suffix"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    opaque = etag.strip('"')
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"').split('-', 1)[0] == opaque:
+            return True
+    return False
+
+
+def cached_json_response(request: Request, cached: CachedResponse) -> Response:
+    """Answer from a cached response: 304 when the client is current, else the best precompressed body"""
+    encodings = accepted_encodings(request.headers.get('accept-encoding'))
+    if cached.br is not None and 'br' in encodings:
+        body, encoding = cached.br, 'br'
+    elif cached.gzip is not None and 'gzip' in encodings:
+        body, encoding = cached.gzip, 'gzip'
+    else:
+        body, encoding = cached.body, None
+
+    # Each encoding is a different representation and needs its own strong validator
+    headers = {
+        "ETag": cached.etag if encoding is None else cached.etag[:-1] + f'-{encoding}"',
+        "Cache-Control": cache_control(cached.ttl),
+        "Vary": "Accept-Encoding",
+    }
+
+    if etag_matches(request.headers.get('if-none-match'), cached.etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,199 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import Request
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+import threading
+import time
+from .kafka_producer import kafka_producer
+
+# Instrumentation Configuration
+METRICS_WINDOW_SECONDS = int(os.getenv('METRICS_WINDOW_SECONDS', '300'))
+METRICS_WINDOW_SLOTS = 5
+
+# Upper bounds in seconds, from cache hits up to cold weekend loads
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Scrapes and health checks are measured but not reported as usage events
+UNTRACKED_PATHS = ('/metrics', '/api/health')
+
+# Phase durations in seconds for the request being handled. Tasks and load threads
+# started by the request inherit the same dict, so their phases land here too.
+_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar('request_phases', default=None)
+
+
+def record_phase(name: str, seconds: float) -> None:
+    phases = _phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block as one phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+class Histogram:
+    """Cumulative bucket counts plus a rolling window of recent ones for quantiles"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._slot_seconds = METRICS_WINDOW_SECONDS / METRICS_WINDOW_SLOTS
+        self._slots: List[Tuple[int, List[int]]] = []
+
+    def observe(self, seconds: float) -> None:
+        index = bisect_left(LATENCY_BUCKETS, seconds)
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+        slot_id = int(time.monotonic() // self._slot_seconds)
+        if not self._slots or self._slots[-1][0] != slot_id:
+            self._slots.append((slot_id, [0] * len(self.counts)))
+            self._slots = self._slots[-METRICS_WINDOW_SLOTS:]
+        self._slots[-1][1][index] += 1
+
+    def recent_quantiles(self) -> Dict[float, Optional[float]]:
+        """Bucket upper bound at each quantile over the rolling window"""
+        oldest = int(time.monotonic() // self._slot_seconds) - METRICS_WINDOW_SLOTS + 1
+        merged = [0] * len(self.counts)
+        for slot_id, counts in self._slots:
+            if slot_id >= oldest:
+                merged = [a + b for a, b in zip(merged, counts)]
+
+        total = sum(merged)
+        result: Dict[float, Optional[float]] = {}
+        for q in QUANTILES:
+            if total == 0:
+                result[q] = None
+                continue
+            rank, seen = q * total, 0
+            for index, count in enumerate(merged):
+                seen += count
+                if seen >= rank:
+                    result[q] = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else float('inf')
+                    break
+        return result
+
+
+class RequestMetrics:
+    """Per-route request latency and per-phase duration histograms"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.phases: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, route: str, method: str, status_code: int, seconds: float, phases: Dict[str, float]) -> None:
+        with self._lock:
+            key = (route, method, status_code)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault((route, method), Histogram()).observe(seconds)
+            for name, phase_seconds in phases.items():
+                self.phases.setdefault((route, name), Histogram()).observe(phase_seconds)
+
+    def observe_phase(self, route: str, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases.setdefault((route, name), Histogram()).observe(seconds)
+
+    def render(self) -> str:
+        """Prometheus text exposition of every metric"""
+        lines = [
+            "# HELP f1_requests_total Requests handled by route, method and status",
+            "# TYPE f1_requests_total counter",
+        ]
+        with self._lock:
+            for (route, method, status_code), count in sorted(self.requests.items()):
+                lines.append(f'f1_requests_total{{route="{route}",method="{method}",status="{status_code}"}} {count}')
+
+            lines += [
+                "# HELP f1_request_duration_seconds Request latency by route",
+                "# TYPE f1_request_duration_seconds histogram",
+            ]
+            for (route, method), histogram in sorted(self.latency.items()):
+                lines += _histogram_lines("f1_request_duration_seconds", f'route="{route}",method="{method}"', histogram)
+
+            lines += [
+                "# HELP f1_request_recent_duration_seconds Request latency quantiles over the rolling window",
+                "# TYPE f1_request_recent_duration_seconds gauge",
+            ]
+            for (route, method), histogram in sorted(self.latency.items()):
+                for q, value in histogram.recent_quantiles().items():
+                    if value is not None:
+                        lines.append(
+                            f'f1_request_recent_duration_seconds{{route="{route}",method="{method}",quantile="{q}"}} {_number(value)}'
+                        )
+
+            lines += [
+                "# HELP f1_request_phase_seconds Time spent in each phase of a request",
+                "# TYPE f1_request_phase_seconds histogram",
+            ]
+            for (route, name), histogram in sorted(self.phases.items()):
+                lines += _histogram_lines("f1_request_phase_seconds", f'route="{route}",phase="{name}"', histogram)
+
+        return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == float('inf') else repr(value)
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{_number(bound)}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+def route_label(request: Request) -> str:
+    """Route template rather than the raw path, keeping label cardinality bounded"""
+    route = request.scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+async def instrumentation_middleware(request: Request, call_next):
+    """Time every request once, record it in the histograms and report it as a usage event"""
+    phases: Dict[str, float] = {}
+    token = _phases.set(phases)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        _phases.reset(token)
+
+        route = route_label(request)
+        request_metrics.observe(route, request.method, status_code, elapsed, phases)
+
+        if request.url.path not in UNTRACKED_PATHS:
+            send_start = time.perf_counter()
+            kafka_producer.send_usage_event(
+                endpoint=request.url.path,
+                method=request.method,
+                status_code=status_code,
+                response_time=elapsed * 1000,
+                user_agent=request.headers.get('user-agent'),
+                query_params=dict(request.query_params),
+            )
+            request_metrics.observe_phase(route, 'send', time.perf_counter() - send_start)
+
+
+# Global metrics registry
+request_metrics = RequestMetrics()
@@ -1,14 +1,30 @@
 from kafka import KafkaProducer
-import json
+from collections import deque
 import logging
-from datetime import datetime
-from zoneinfo import ZoneInfo
-from typing import Optional
+from typing import Any, List, Optional, Tuple
 import os
+import random
+import threading
 import time
+import uuid
+from .usage_aggregator import SUMMARY_TYPE, UsageAggregator
+from .wire import FORMAT_HEADER, MSGPACK_BATCH_V2, MSGPACK_FORMAT, WIRE_FORMATS, encode_batches, encode_json
 
 logger = logging.getLogger(__name__)
 
+# Overflow policies applied when the in-memory buffer is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+SAMPLE = 'sample'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, SAMPLE)
+
+# Usage telemetry modes: one message per request, or one summary per window plus sampled raw events
+RAW_MODE = 'raw'
+AGGREGATE_MODE = 'aggregate'
+TELEMETRY_MODES = (RAW_MODE, AGGREGATE_MODE)
+
+SERVICE_NAME = 'f1-service'
+
 
 class F1KafkaProducer:
     def __init__(self, retries: int = 5, delay_seconds: float = 3.0) -> None:
@@ -18,9 +34,62 @@ class F1KafkaProducer:
         self.retries = retries
         self.delay_seconds = delay_seconds
 
+        # Buffering and batching
+        self.queue_size = int(os.getenv('KAFKA_QUEUE_SIZE', '10000'))
+        self.max_batch_events = int(os.getenv('KAFKA_MAX_BATCH_EVENTS', '500'))
+        self.linger_ms = int(os.getenv('KAFKA_LINGER_MS', '100'))
+        self.batch_bytes = int(os.getenv('KAFKA_BATCH_BYTES', '65536'))
+        self.compression_type = os.getenv('KAFKA_COMPRESSION', 'gzip') or None
+        self.flush_timeout_seconds = float(os.getenv('KAFKA_FLUSH_TIMEOUT_SECONDS', '10'))
+        self.overflow_policy = os.getenv('KAFKA_OVERFLOW_POLICY', DROP_OLDEST)
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            logger.warning(f"Unknown overflow policy {self.overflow_policy}, using {DROP_OLDEST}")
+            self.overflow_policy = DROP_OLDEST
+
+        # Record encoding, json is only needed while stats consumers predate the msgpack batches
+        self.wire_format = os.getenv('KAFKA_WIRE_FORMAT', MSGPACK_FORMAT)
+        if self.wire_format not in WIRE_FORMATS:
+            logger.warning(f"Unknown wire format {self.wire_format}, using {MSGPACK_FORMAT}")
+            self.wire_format = MSGPACK_FORMAT
+
+        # Telemetry mode. Windows must divide a minute so summaries map onto the stats minute rollups.
+        self.telemetry_mode = os.getenv('USAGE_TELEMETRY_MODE', RAW_MODE)
+        if self.telemetry_mode not in TELEMETRY_MODES:
+            logger.warning(f"Unknown usage telemetry mode {self.telemetry_mode}, using {RAW_MODE}")
+            self.telemetry_mode = RAW_MODE
+        window_seconds = int(os.getenv('USAGE_WINDOW_SECONDS', '60'))
+        if window_seconds <= 0 or 60 % window_seconds != 0:
+            logger.warning(f"USAGE_WINDOW_SECONDS={window_seconds} does not divide a minute, using 60")
+            window_seconds = 60
+        self.raw_sample_rate = min(max(float(os.getenv('USAGE_RAW_SAMPLE_RATE', '0.01')), 0.0), 1.0)
+        self.aggregator: Optional[UsageAggregator] = None
+        if self.telemetry_mode == AGGREGATE_MODE:
+            self.aggregator = UsageAggregator(SERVICE_NAME, window_seconds)
+
         self.producer: Optional[KafkaProducer] = None
 
-        self._connect_with_retry()
+        self._buffer: deque = deque()
+        # Window summaries wait here, outside the reach of the overflow policies
+        self._summaries: deque = deque()
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._sender_thread: Optional[threading.Thread] = None
+        self._overflow_seen = 0
+
+        # Counters
+        self.enqueued = 0
+        self.sent = 0
+        self.records_sent = 0
+        self.bytes_sent = 0
+        self.failed = 0
+        self.records_failed = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.dropped_sampled = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
 
     def _connect_with_retry(self) -> None:
         """Attempt to create a KafkaProducer with simple retry logic."""
@@ -30,12 +99,16 @@ class F1KafkaProducer:
                     f"Connecting to Kafka at {self.kafka_server_endpoint} "
                     f"(attempt {attempt}/{self.retries})"
                 )
-                
+
                 producer_config = {
                     'bootstrap_servers': [self.kafka_server_endpoint],
-                    'value_serializer': lambda v: json.dumps(v).encode('utf-8'),
+                    'linger_ms': self.linger_ms,
+                    'batch_size': self.batch_bytes,
+                    'compression_type': self.compression_type,
+                    # Only the sender thread blocks on metadata, but don't let it hang forever
+                    'max_block_ms': 5000,
                 }
-                
+
                 if self.kafka_api_key and self.kafka_api_secret:
                     producer_config.update({
                         'security_protocol': 'SASL_SSL',
@@ -44,7 +117,7 @@ class F1KafkaProducer:
                         'sasl_plain_password': self.kafka_api_secret,
                     })
                     logger.info("Using SASL authentication for Kafka")
-                
+
                 self.producer = KafkaProducer(**producer_config)
                 logger.info(f"Kafka producer connected to {self.kafka_server_endpoint}")
                 return
@@ -52,12 +125,24 @@ class F1KafkaProducer:
                 logger.warning(f"Failed to connect to Kafka: {e}")
                 self.producer = None
                 if attempt < self.retries:
-                    time.sleep(self.delay_seconds)
+                    self._stop_event.wait(self.delay_seconds)
+                    if self._stop_event.is_set():
+                        return
                 else:
                     logger.error(
                         f"Giving up connecting to Kafka after {self.retries} attempts"
                     )
 
+    def start(self) -> None:
+        """Start the background sender thread"""
+        if self._sender_thread is not None and self._sender_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._sender_thread = threading.Thread(target=self._run, name='kafka-sender', daemon=True)
+        self._sender_thread.start()
+        logger.info("Kafka sender started")
+
     def send_usage_event(
         self,
         endpoint: str,
@@ -67,44 +152,224 @@ class F1KafkaProducer:
         user_agent: Optional[str] = None,
         query_params: Optional[dict] = None,
     ) -> None:
-        """Send a usage event to Kafka."""
+        """Queue a usage event for the background sender, never blocking on Kafka.
 
-        if self.producer is None:
-            logger.info("Kafka producer not initialized; attempting to reconnect...")
-            self._connect_with_retry()
+        In aggregate mode the event is folded into the current window and only a
+        sampled fraction is queued as a raw event.
+        """
 
-        if self.producer is None:
-            logger.warning("Kafka producer still unavailable, skipping event")
-            return
+        sampled = False
+        if self.aggregator is not None:
+            self.aggregator.add(endpoint, method, status_code, response_time)
+            if random.random() >= self.raw_sample_rate:
+                return
+            sampled = True
 
+        # Formatting the timestamp is left to the sender thread
         event = {
-            "service": "f1-service",
+            # Lets the stats service ignore redelivered copies of the event
+            "event_id": uuid.uuid4(),
+            "service": SERVICE_NAME,
             "endpoint": endpoint,
             "method": method,
             "status_code": status_code,
             "response_time_ms": response_time,
-            "timestamp": datetime.now(ZoneInfo("America/Chicago")).isoformat(),
+            "timestamp_ms": int(time.time() * 1000),
             "user_agent": user_agent,
             "query_params": query_params,
         }
+        if sampled:
+            # Already counted by a summary, the stats service must keep it out of the rollups
+            event["sampled"] = True
+
+        self._enqueue(event)
+
+    def _enqueue(self, event: dict) -> None:
+        with self._condition:
+            if len(self._buffer) >= self.queue_size:
+                if self.overflow_policy == DROP_NEWEST:
+                    self.dropped_newest += 1
+                    return
+
+                if self.overflow_policy == SAMPLE:
+                    # Reservoir sampling keeps a uniform sample of everything seen while full
+                    self._overflow_seen += 1
+                    slot = random.randrange(self.queue_size + self._overflow_seen)
+                    if slot < self.queue_size:
+                        self._buffer[slot] = event
+                    self.dropped_sampled += 1
+                    return
+
+                self._buffer.popleft()
+                self.dropped_oldest += 1
+
+            self._buffer.append(event)
+            self.enqueued += 1
+
+            if len(self._buffer) >= self.max_batch_events:
+                self._condition.notify()
+
+    def _queue_summaries(self, include_open: bool = False) -> None:
+        """Move finished window summaries to their own queue, which the overflow policies never touch
 
+        There are only a handful per minute and each stands for many requests,
+        so they are never the ones dropped.
+        """
+        if self.aggregator is None:
+            return
+
+        summaries = self.aggregator.drain(include_open)
+        if summaries:
+            with self._condition:
+                self._summaries.extend(summaries)
+                self.enqueued += len(summaries)
+
+    def _next_batch(self) -> List[dict]:
+        """Wait up to linger_ms for a full batch, then take whatever is buffered"""
+        deadline = time.monotonic() + self.linger_ms / 1000
+        with self._condition:
+            while len(self._summaries) + len(self._buffer) < self.max_batch_events and not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # Summaries go first
+            batch = [self._summaries.popleft() for _ in range(min(len(self._summaries), self.max_batch_events))]
+            batch_len = min(len(self._buffer), self.max_batch_events - len(batch))
+            batch += [self._buffer.popleft() for _ in range(batch_len)]
+            if len(self._buffer) < self.queue_size:
+                self._overflow_seen = 0
+            return batch
+
+    def _run(self) -> None:
+        """Drain the buffer to Kafka in batches until stopped"""
+        while not self._stop_event.is_set():
+            self._queue_summaries()
+            if self.producer is None:
+                self._connect_with_retry()
+                if self.producer is None:
+                    # Keep buffering (subject to the overflow policy) until Kafka is back
+                    self._stop_event.wait(self.delay_seconds)
+                    continue
+
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: List[dict]) -> None:
+        start = time.perf_counter()
+        # Each record's items, size and delivery future
+        records: List[Tuple[List[dict], int, Any]] = []
+        error: Optional[Exception] = None
         try:
-            future = self.producer.send('api-usage', value=event)
-            future.get(timeout=10)  # Wait for confirmation
-            logger.debug(f"Sent usage event for {endpoint}")
+            if self.wire_format == MSGPACK_FORMAT:
+                for items, payload in encode_batches(SERVICE_NAME, batch):
+                    future = self.producer.send('api-usage', value=payload, headers=[(FORMAT_HEADER, MSGPACK_BATCH_V2)])
+                    records.append((items, len(payload), future))
+            else:
+                for item in batch:
+                    payload = encode_json(item)
+                    records.append(([item], len(payload), self.producer.send('api-usage', value=payload)))
+            self.producer.flush(timeout=self.flush_timeout_seconds)
         except Exception as e:
-            logger.error(f"Failed to send Kafka message: {e}")
+            error = e
+        finally:
+            flush_ms = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.last_flush_ms = flush_ms
+            self.max_flush_ms = max(self.max_flush_ms, flush_ms)
+            self.total_flush_ms += flush_ms
+        raised = error is not None
 
-    def close(self) -> None:
+        # flush() returns even when some records failed, only their futures tell
+        delivered = set()
+        for items, size, future in records:
+            try:
+                future.get(timeout=0)
+            except Exception as e:
+                error = error or e
+                self.records_failed += 1
+                continue
+            delivered.update(id(item) for item in items)
+            self.records_sent += 1
+            self.bytes_sent += size
+
+        undelivered = [item for item in batch if id(item) not in delivered]
+        self.sent += len(batch) - len(undelivered)
+        if not undelivered:
+            logger.debug(f"Sent {len(batch)} usage events")
+            return
+
+        # Summaries are retried, the stats service skips any that did arrive by their summary_id
+        summaries = [item for item in undelivered if item.get('type') == SUMMARY_TYPE]
+        with self._condition:
+            self._summaries.extendleft(reversed(summaries))
+        self.failed += len(undelivered) - len(summaries)
+        logger.error(f"Failed to deliver {len(undelivered)} of {len(batch)} usage events: {error}")
+        if raised:
+            self._close_producer()
+
+    def stats(self) -> dict:
+        with self._condition:
+            queue_depth = len(self._buffer)
+            summaries_pending = len(self._summaries)
+
+        return {
+            "connected": self.producer is not None,
+            "overflow_policy": self.overflow_policy,
+            "telemetry_mode": self.telemetry_mode,
+            "queue_depth": queue_depth,
+            "queue_size": self.queue_size,
+            "summaries_pending": summaries_pending,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "wire_format": self.wire_format,
+            "records_sent": self.records_sent,
+            "bytes_sent": self.bytes_sent,
+            "failed": self.failed,
+            "records_failed": self.records_failed,
+            "dropped": {
+                DROP_OLDEST: self.dropped_oldest,
+                DROP_NEWEST: self.dropped_newest,
+                SAMPLE: self.dropped_sampled,
+            },
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0,
+            "aggregation": {**self.aggregator.stats(), "raw_sample_rate": self.raw_sample_rate} if self.aggregator is not None else None,
+        }
+
+    def _close_producer(self) -> None:
         if self.producer is not None:
             try:
-                self.producer.flush()
-                self.producer.close()
+                self.producer.close(timeout=self.flush_timeout_seconds)
             except Exception as e:
                 logger.error(f"Error while closing Kafka producer: {e}")
             finally:
                 self.producer = None
 
+    def close(self) -> None:
+        """Stop the sender and make a best-effort attempt to deliver what is still buffered"""
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+        if self._sender_thread is not None:
+            self._sender_thread.join(timeout=self.flush_timeout_seconds)
+            self._sender_thread = None
+
+        # The open window is cut short rather than lost
+        self._queue_summaries(include_open=True)
+        while self.producer is not None:
+            batch = self._next_batch()
+            if not batch:
+                break
+            self._flush(batch)
+
+        self._close_producer()
+
 
 # Global producer instance
 kafka_producer = F1KafkaProducer()
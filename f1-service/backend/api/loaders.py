@@ -0,0 +1,202 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional, Tuple
+import fastf1
+import pandas as pd
+from .utils import aggregate_weekend, get_race_start
+from .cache import HISTORICAL_TTL_SECONDS, CachedResponse, data_cache, response_cache, ttl_for, ttl_for_season
+from .concurrency import run_blocking, run_warm, single_flight
+from .result_store import WEEKEND_KEY, frame_from_ipc, frame_to_ipc, result_key, result_store
+from .shared_cache import shared_cache
+from .admission import admission
+from .instrumentation import phase
+from .standings import load_season_standings
+
+Fields = Optional[Tuple[str, ...]]
+
+
+class InvalidFieldsError(ValueError):
+    """Raised when a fields= projection names columns the data does not have"""
+
+
+def parse_fields(fields: Optional[str]) -> Fields:
+    """Turn a comma separated fields= parameter into a column tuple, None meaning all columns"""
+    if not fields:
+        return None
+    return tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip())) or None
+
+
+def encode_records(root: str, frame: pd.DataFrame, fields: Fields = None) -> bytes:
+    """Encode a DataFrame once, straight into the final {"status": 200, root: [...]} body"""
+    if fields and len(frame.columns):
+        missing = [f for f in fields if f not in frame.columns]
+        if missing:
+            raise InvalidFieldsError(f"Unknown fields: {', '.join(missing)}")
+        frame = frame[list(fields)]
+
+    with phase('serialize'):
+        records = frame.to_json(orient='records', date_format='iso')
+        return b'{"status":200,"' + root.encode() + b'":' + records.encode() + b'}'
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """An endpoint's data: how to load it whole and how to turn it into a response body.
+
+    DataFrame datasets have a body root and are projected per request, others load a finished body.
+    """
+    load: Callable[..., Tuple[Any, float]]
+    root: Optional[str] = None
+    # Settled data in the result store, read without a FastF1 load
+    stored: Optional[Callable[..., Optional[pd.DataFrame]]] = None
+
+    def encode(self, data: Any, fields: Fields) -> bytes:
+        return data if self.root is None else encode_records(self.root, data, fields)
+
+    def dump(self, data: Any) -> Optional[bytes]:
+        """Bytes shared with the other workers, None if the data cannot be shared"""
+        return data if self.root is None else frame_to_ipc(data)
+
+    def parse(self, payload: bytes) -> Any:
+        return payload if self.root is None else frame_from_ipc(payload)
+
+
+@dataclass(frozen=True)
+class LoadedData:
+    """A dataset's full data as loaded, before any fields= projection"""
+    data: Any
+    ttl: float
+
+    @property
+    def size(self) -> int:
+        if isinstance(self.data, bytes):
+            return len(self.data)
+        return int(self.data.memory_usage(index=True).sum())
+
+
+# Blocking loaders, each returns the full data and its cache TTL
+
+def load_session_info(year: int, round: int | str, sessionCd: str) -> Tuple[pd.DataFrame, float]:
+    """Load a session's results"""
+    with phase('fastf1_load'):
+        session = fastf1.get_session(year, round, sessionCd)
+
+        # Minimize Data Sent
+        session.load(telemetry=False, weather=False, messages=False, livedata=False)
+    ttl = ttl_for(session.date)
+
+    # Only settled results are stored, live ones can still change
+    if ttl == HISTORICAL_TTL_SECONDS:
+        result_store.write(result_key(year, round, sessionCd), session.results)
+    return session.results, ttl
+
+
+def load_weekend_results(year: int, round: int | str) -> Tuple[pd.DataFrame, float]:
+    """Aggregate a weekend's points"""
+    with phase('fastf1_load'):
+        result = aggregate_weekend(year, round)
+        ttl = ttl_for(get_race_start(year, round))
+
+    if ttl == HISTORICAL_TTL_SECONDS:
+        result_store.write(result_key(year, round, WEEKEND_KEY), result)
+    return result, ttl
+
+
+def load_schedule(year: int) -> Tuple[pd.DataFrame, float]:
+    """Load a season's event schedule"""
+    with phase('fastf1_load'):
+        schedule = fastf1.get_event_schedule(year)
+    return schedule, ttl_for_season(year)
+
+
+def stored_session_info(year: int, round: int | str, sessionCd: str) -> Optional[pd.DataFrame]:
+    return result_store.read(result_key(year, round, sessionCd))
+
+
+def stored_weekend_results(year: int, round: int | str) -> Optional[pd.DataFrame]:
+    return result_store.read(result_key(year, round, WEEKEND_KEY))
+
+
+SESSION_INFO = Dataset(load_session_info, 'session', stored_session_info)
+WEEKEND_RESULTS = Dataset(load_weekend_results, 'standings', stored_weekend_results)
+SCHEDULE = Dataset(load_schedule, 'schedule')
+SEASON_STANDINGS = Dataset(load_season_standings)
+
+
+def data_key(cache_key: Hashable) -> Hashable:
+    """Cache keys end with the fields= projection, the data behind them does not depend on it"""
+    return cache_key[:-1]
+
+
+def read_warm(key: Hashable, dataset: Dataset, *args) -> Optional[LoadedData]:
+    """Blocking: data another worker shared or the result store holds, None if it needs a FastF1 load"""
+    if shared_cache is not None:
+        entry = shared_cache.get(key)
+        if entry is not None:
+            payload, ttl = entry
+            return LoadedData(dataset.parse(payload), ttl)
+
+    if dataset.stored is not None:
+        stored = dataset.stored(*args)
+        if stored is not None:
+            return LoadedData(stored, HISTORICAL_TTL_SECONDS)
+    return None
+
+
+def load_data(key: Hashable, dataset: Dataset, *args) -> LoadedData:
+    """Blocking: load a dataset, at most once machine-wide when the cross-worker cache is enabled"""
+    if shared_cache is None:
+        return LoadedData(*dataset.load(*args))
+
+    loaded = {}
+
+    def load_shared() -> Tuple[Optional[bytes], float]:
+        data, ttl = dataset.load(*args)
+        loaded['data'] = data
+        return dataset.dump(data), ttl
+
+    payload, ttl = shared_cache.load(key, load_shared)
+    return LoadedData(loaded['data'] if 'data' in loaded else dataset.parse(payload), ttl)
+
+
+def build_response(dataset: Dataset, loaded: LoadedData, fields: Fields) -> CachedResponse:
+    """Blocking: project, serialize and precompress one response body"""
+    return CachedResponse.build(dataset.encode(loaded.data, fields), loaded.ttl)
+
+
+async def get_data(key: Hashable, dataset: Dataset, *args) -> LoadedData:
+    """Serve a dataset from the data cache, loading it at most once across concurrent misses.
+
+    Data keys start with the endpoint path, which sets the load's admission priority.
+    """
+    loaded = data_cache.get(key)
+    if loaded is not None:
+        return loaded
+
+    async def load() -> LoadedData:
+        # Warm data never queues for a cold load slot, only FastF1 loads can be shed
+        loaded = await run_warm(read_warm, key, dataset, *args)
+        if loaded is None:
+            async with admission.slot(key[0]):
+                loaded = await run_blocking(load_data, key, dataset, *args)
+        data_cache.put(key, loaded, loaded.ttl)
+        return loaded
+
+    return await single_flight.do(key, load)
+
+
+async def get_cached_response(cache_key: Hashable, dataset: Dataset, *args) -> CachedResponse:
+    """Serve a response from the response cache, building it at most once across concurrent misses.
+
+    Cache keys end with the fields= projection. Every projection is built from the same loaded data.
+    """
+    response = response_cache.get(cache_key)
+    if response is not None:
+        return response
+
+    async def build() -> CachedResponse:
+        loaded = await get_data(data_key(cache_key), dataset, *args)
+        response = await run_warm(build_response, dataset, loaded, cache_key[-1])
+        response_cache.put(cache_key, response, response.ttl)
+        return response
+
+    return await single_flight.do(cache_key, build)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel 
-from typing import Any, List
+from pydantic import BaseModel
+from typing import Any, List, Optional
 
 # Models
 class F1Data(BaseModel):
@@ -22,4 +22,17 @@ class StandingsResponse(BaseModel):
 
 class SessionResponse(BaseModel):
     status: int
-    session: Any
\ No newline at end of file
+    session: Any
+
+class SessionRequest(BaseModel):
+    year: int
+    round: int | str
+    sessionCd: str
+
+class SessionBatchRequest(BaseModel):
+    sessions: List[SessionRequest]
+    fields: Optional[str] = None
+
+class SessionBatchResponse(BaseModel):
+    status: int
+    results: Any
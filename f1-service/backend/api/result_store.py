@@ -0,0 +1,136 @@
+from typing import Optional, Sequence, Tuple
+import logging
+import os
+import re
+import tempfile
+import threading
+import uuid
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Result Store Configuration
+RESULT_STORE_DIR = os.getenv('RESULT_STORE_DIR', os.path.join(tempfile.gettempdir(), 'f1-results'))
+RESULT_STORE_ENABLED = os.getenv('RESULT_STORE_ENABLED', 'true').lower() == 'true'
+
+WEEKEND_KEY = 'weekend'
+
+
+def _path_part(value) -> str:
+    """Filesystem-safe, case-insensitive form of a year, round or session identifier"""
+    return re.sub(r'[^a-z0-9]+', '_', str(value).lower()).strip('_') or '_'
+
+
+def result_key(year: int, round: int | str, session: str) -> Tuple[str, str, str]:
+    return (_path_part(year), _path_part(round), _path_part(session))
+
+
+def frame_to_ipc(frame: pd.DataFrame) -> Optional[bytes]:
+    """A frame as Arrow IPC stream bytes, or None when Arrow cannot represent it"""
+    try:
+        table = pa.Table.from_pandas(pd.DataFrame(frame), preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    except Exception as e:
+        logger.warning(f"Could not convert frame to Arrow: {e}")
+        return None
+
+
+def table_to_frame(table: pa.Table) -> pd.DataFrame:
+    """Convert without consolidating columns, so numeric columns without nulls keep pointing
+    at the Arrow buffers. Strings, timestamps and columns with nulls are still copied.
+    The table must not be used afterwards."""
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def frame_from_ipc(payload: bytes) -> pd.DataFrame:
+    return table_to_frame(pa.ipc.open_stream(payload).read_all())
+
+
+class ResultStore:
+    """Arrow IPC files of settled session and weekend results, read back memory-mapped.
+
+    Files are written once a session's results are final and never change afterwards,
+    so concurrent readers in any process can map them without coordination.
+    """
+
+    def __init__(self, root: str = RESULT_STORE_DIR, enabled: bool = RESULT_STORE_ENABLED) -> None:
+        self.root = root
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def path(self, key: Tuple[str, str, str]) -> str:
+        year, round, session = key
+        return os.path.join(self.root, year, round, f"{session}.arrow")
+
+    def read(self, key: Tuple[str, str, str], fields: Optional[Sequence[str]] = None) -> Optional[pd.DataFrame]:
+        """Load stored results, only materializing the requested columns"""
+        if not self.enabled:
+            return None
+
+        try:
+            with pa.memory_map(self.path(key)) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except Exception as e:
+            self._count('errors')
+            logger.warning(f"Could not read stored results {key}: {e}")
+            return None
+
+        # Unknown fields are left for encode_records to report
+        if fields and set(fields) <= set(table.column_names):
+            table = table.select(list(fields))
+
+        self._count('hits')
+        # Numeric columns stay backed by the mapped file, which every worker shares in the page cache
+        return table_to_frame(table)
+
+    def write(self, key: Tuple[str, str, str], frame: pd.DataFrame) -> None:
+        """Atomically store results, skipping frames Arrow cannot represent"""
+        if not self.enabled or frame.empty:
+            return
+
+        path = self.path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            table = pa.Table.from_pandas(pd.DataFrame(frame), preserve_index=False)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+            self._count('writes')
+        except Exception as e:
+            self._count('errors')
+            logger.warning(f"Could not store results {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "errors": self.errors,
+            }
+
+
+# Global store instance
+result_store = ResultStore()
@@ -0,0 +1,242 @@
+from contextlib import contextmanager
+from typing import Callable, Hashable, Iterator, Optional, Tuple
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Worker processes started by uvicorn, see the Dockerfile
+F1_WORKERS = int(os.getenv('F1_WORKERS', '1'))
+
+# Shared Cache Configuration, on by default whenever there is more than one worker
+SHARED_CACHE_ENABLED = os.getenv('SHARED_CACHE_ENABLED', 'true' if F1_WORKERS > 1 else 'false').lower() == 'true'
+# /dev/shm keeps entries in memory while still being visible to every worker
+SHARED_CACHE_DIR = os.getenv(
+    'SHARED_CACHE_DIR',
+    '/dev/shm/f1-response-cache' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'f1-response-cache'),
+)
+# Docker gives containers a 64 MB /dev/shm unless shm_size is raised, stay below it by default
+SHARED_CACHE_MAX_BYTES = int(os.getenv('SHARED_CACHE_MAX_BYTES', str(48 * 1024 * 1024)))
+# Check the directory size every this many writes
+SHARED_CACHE_PRUNE_EVERY = 64
+# Temporary files older than this were left behind by a crashed writer
+STALE_TMP_SECONDS = 60
+
+# Each entry file starts with its expiry as a wall-clock timestamp, shared by all processes
+HEADER = struct.Struct('<d')
+
+
+def entry_name(key: Hashable) -> str:
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+class SharedCache:
+    """Response bodies shared by all worker processes as files, with per-key file locks.
+
+    A process holding a key's lock is the only one on the machine loading that key, the
+    others block on the lock and then read what it stored.
+    """
+
+    def __init__(self, root: str = SHARED_CACHE_DIR, max_bytes: int = SHARED_CACHE_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.waited_hits = 0
+        os.makedirs(os.path.join(self.root, 'locks'), exist_ok=True)
+
+    def _entry_path(self, name: str) -> str:
+        return os.path.join(self.root, f"{name}.entry")
+
+    def _read(self, name: str) -> Optional[Tuple[bytes, float]]:
+        """Body and remaining TTL of an entry, or None if missing or expired"""
+        try:
+            with open(self._entry_path(name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < HEADER.size:
+            return None
+
+        (expires_at,) = HEADER.unpack_from(data)
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            try:
+                os.remove(self._entry_path(name))
+            except OSError:
+                pass
+            return None
+
+        return data[HEADER.size:], remaining
+
+    def _write(self, name: str, body: bytes, ttl_seconds: float) -> None:
+        """Atomically replace an entry so readers never see a partial file"""
+        path = self._entry_path(name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        expires_at = time.time() + ttl_seconds
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(HEADER.pack(expires_at))
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A full /dev/shm must not also fill up with half written files
+            self._remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % SHARED_CACHE_PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    @contextmanager
+    def _key_lock(self, name: str) -> Iterator[None]:
+        with open(os.path.join(self.root, 'locks', f"{name}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, float]]:
+        """Body and remaining TTL another worker stored for a key, without waiting on its lock"""
+        entry = self._read(entry_name(key))
+        if entry is not None:
+            self._count('hits')
+        return entry
+
+    def load(self, key: Hashable, loader: Callable[..., Tuple[Optional[bytes], float]], *args) -> Tuple[Optional[bytes], float]:
+        """Blocking: return the shared body for a key, running the loader at most once machine-wide
+
+        A loader returning None instead of a body is not shared, the caller keeps what it loaded.
+        """
+        name = entry_name(key)
+        entry = self._read(name)
+        if entry is not None:
+            self._count('hits')
+            return entry
+
+        with self._key_lock(name):
+            # Another worker may have finished the load while this one waited for the lock
+            entry = self._read(name)
+            if entry is not None:
+                self._count('waited_hits')
+                return entry
+
+            self._count('misses')
+            body, ttl = loader(*args)
+            if body is None:
+                return body, ttl
+            try:
+                self._write(name, body, ttl)
+                self._count('loads')
+            except OSError as e:
+                logger.warning(f"Could not write shared cache entry: {e}")
+                # Most likely out of space, make room for the next write
+                self.prune()
+            return body, ttl
+
+    def prune(self) -> None:
+        """Remove stale temporary files and expired entries, then the oldest entries until
+        the directory fits max_bytes, then the locks of keys without an entry"""
+        entries = []
+        live = set()
+        total = 0
+        now = time.time()
+        for file_name in os.listdir(self.root):
+            path = os.path.join(self.root, file_name)
+            if file_name.endswith('.tmp'):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > STALE_TMP_SECONDS:
+                    self._remove(path)
+                else:
+                    # A write in progress still takes up space
+                    total += stat.st_size
+                continue
+
+            if not file_name.endswith('.entry'):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    (expires_at,) = HEADER.unpack(f.read(HEADER.size))
+                stat = os.stat(path)
+            except (OSError, struct.error):
+                continue
+
+            if expires_at <= now:
+                self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            live.add(file_name[:-len('.entry')])
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            live.discard(os.path.basename(path)[:-len('.entry')])
+            total -= size
+
+        self._prune_locks(live)
+
+    def _prune_locks(self, live: set) -> None:
+        """Remove lock files of keys without an entry that nobody holds
+
+        A process that opened the file just before it is removed can still end up loading
+        the key alongside a newer lock holder. That costs a duplicate load, entries are
+        replaced atomically either way.
+        """
+        lock_dir = os.path.join(self.root, 'locks')
+        for file_name in os.listdir(lock_dir):
+            if not file_name.endswith('.lock') or file_name[:-len('.lock')] in live:
+                continue
+            path = os.path.join(lock_dir, file_name)
+            try:
+                with open(path, 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self._remove(path)
+            except OSError:
+                # Held by a load in progress
+                continue
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        """Counters are for this worker only, the entries are shared"""
+        with self._lock:
+            return {
+                "enabled": True,
+                "dir": self.root,
+                "hits": self.hits,
+                "misses": self.misses,
+                "waited_hits": self.waited_hits,
+                "loads": self.loads,
+            }
+
+
+# Global shared cache, None when running a single worker
+shared_cache = SharedCache() if SHARED_CACHE_ENABLED else None
@@ -0,0 +1,15 @@
+import math
+
+# Must match stats-service/backend/api/sketch.py, the stats service merges these bins
+# with the ones it computes from raw events
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Latencies below this (including 0 ms) share the lowest bin
+MIN_TRACKED_MS = 0.001
+
+
+def bin_index(value: float) -> int:
+    """Map a latency to the index of the bin containing it"""
+    return math.ceil(math.log(max(value, MIN_TRACKED_MS)) / LOG_GAMMA)
@@ -0,0 +1,155 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+import fastf1
+import pandas as pd
+from .cache import HISTORICAL_TTL_SECONDS, ttl_for, ttl_for_season
+from .result_store import WEEKEND_KEY, result_key, result_store
+from .utils import WeekendLoads, cancel_weekend, submit_weekend, weekend_points
+from .instrumentation import phase
+
+# Stored after every settled round: the weekend points of every round up to and including it
+PARTIAL_KEY = 'season_points'
+
+ROUND_COLUMNS = ['DriverId', 'Abbreviation', 'FullName', 'TeamName', 'Points']
+# Without these a round cannot count towards either championship, the others default to ''
+REQUIRED_COLUMNS = ['DriverId', 'TeamName', 'Points']
+
+
+def finished_rounds(year: int) -> List[Tuple[int, datetime]]:
+    """(round, race start in UTC) of every round whose race has started, in order"""
+    schedule = fastf1.get_event_schedule(year, include_testing=False)
+    race_start = schedule['Session5DateUtc'].fillna(schedule['EventDate'])
+    finished = schedule[race_start <= pd.Timestamp(datetime.utcnow())]
+    return [(int(r), race_start[i].to_pydatetime()) for i, r in finished['RoundNumber'].items()]
+
+
+def start_round(year: int, round: int) -> Tuple[Optional[pd.DataFrame], Optional[WeekendLoads]]:
+    """A round's stored weekend aggregate, or else its session loads started on the session pool"""
+    weekend = result_store.read(result_key(year, round, WEEKEND_KEY), ROUND_COLUMNS)
+    if weekend is not None:
+        missing = [c for c in REQUIRED_COLUMNS if c not in weekend.columns]
+        if not missing:
+            return weekend, None
+        print(f"Stored weekend of round {round} of {year} has no {', '.join(missing)}, loading it again")
+    return None, submit_weekend(year, round)
+
+
+def round_points(year: int, round: int, weekend: pd.DataFrame) -> pd.DataFrame:
+    """Weekend points per driver for one round, skipping rounds without driver, team or points"""
+    if weekend.empty:
+        return pd.DataFrame(columns=['Round'] + ROUND_COLUMNS)
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in weekend.columns]
+    if missing:
+        print(f"Skipping round {round} of {year}, its results have no {', '.join(missing)}")
+        return pd.DataFrame(columns=['Round'] + ROUND_COLUMNS)
+
+    points = weekend.reindex(columns=ROUND_COLUMNS, fill_value='')
+    points.insert(0, 'Round', round)
+    return points
+
+
+def season_points(year: int) -> pd.DataFrame:
+    """Per-round points for the season so far, only computing rounds newer than the last stored partial"""
+    rounds = finished_rounds(year)
+
+    points = pd.DataFrame(columns=['Round'] + ROUND_COLUMNS)
+    pending = rounds
+    for i in range(len(rounds) - 1, -1, -1):
+        stored = result_store.read(result_key(year, rounds[i][0], PARTIAL_KEY))
+        if stored is not None:
+            points = stored
+            pending = rounds[i + 1:]
+            break
+
+    # Every pending round's sessions load concurrently, the rounds are then added in order
+    started = []
+    for round, race_start in pending:
+        try:
+            started.append((round, race_start, *start_round(year, round)))
+        except Exception as e:
+            print(f"Could not load round {round} of {year}: {e}")
+            break
+
+    for i, (round, race_start, weekend, loads) in enumerate(started):
+        settled = ttl_for(race_start) == HISTORICAL_TTL_SECONDS
+        try:
+            if weekend is None:
+                weekend = weekend_points(loads)
+                if settled:
+                    result_store.write(result_key(year, round, WEEKEND_KEY), weekend)
+        except Exception as e:
+            # Results not published yet, later rounds cannot be final either
+            print(f"Could not load round {round} of {year}: {e}")
+            for _, _, _, later in started[i + 1:]:
+                cancel_weekend(later)
+            break
+
+        delta = round_points(year, round, weekend)
+        points = pd.concat([points, delta], ignore_index=True) if not points.empty else delta
+
+        # Stored right away, so a failure in a later round keeps this one
+        if settled:
+            result_store.write(result_key(year, round, PARTIAL_KEY), points)
+
+    points['Points'] = points['Points'].astype(float)
+    return points
+
+
+def progression(points: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Cumulative points and championship position of each driver or team after every round"""
+    if points.empty:
+        return pd.DataFrame(columns=['Round', key, 'CumulativePoints', 'Position'])
+
+    per_round = points.pivot_table(index='Round', columns=key, values='Points', aggfunc='sum')
+
+    # Everyone is ranked from their first round on, with no points in rounds they missed
+    started = per_round.notna().cummax()
+    cumulative = per_round.fillna(0).cumsum().where(started)
+    position = cumulative.rank(axis=1, method='first', ascending=False)
+
+    return (
+        pd.concat({'CumulativePoints': cumulative.stack(), 'Position': position.stack()}, axis=1)
+        .reset_index()
+        .astype({'Position': int})
+        .sort_values(['Round', 'Position'], ignore_index=True)
+    )
+
+
+def final_table(points: pd.DataFrame, progress: pd.DataFrame, key: str, info: List[str]) -> pd.DataFrame:
+    """Standings after the last round, with the latest details of each driver or team"""
+    if progress.empty:
+        return pd.DataFrame(columns=['Position', key, *info, 'Points'])
+
+    last = progress[progress['Round'] == progress['Round'].max()]
+    details = points.drop_duplicates(key, keep='last').set_index(key)[info]
+    return (
+        last.join(details, on=key)
+        .rename(columns={'CumulativePoints': 'Points'})[['Position', key, *info, 'Points']]
+        .reset_index(drop=True)
+    )
+
+
+def load_season_standings(year: int) -> Tuple[bytes, float]:
+    """Driver and constructor standings with their round by round progression"""
+    with phase('fastf1_load'):
+        points = season_points(year)
+
+    driver_progress = progression(points, 'DriverId')
+    team_progress = progression(points, 'TeamName')
+    drivers = final_table(points, driver_progress, 'DriverId', ['Abbreviation', 'FullName', 'TeamName'])
+    constructors = final_table(points, team_progress, 'TeamName', [])
+
+    rounds_completed = int(points['Round'].max()) if not points.empty else 0
+    body = (
+        b'{"status":200,"year":' + str(year).encode()
+        + b',"rounds_completed":' + str(rounds_completed).encode()
+        + b',"drivers":' + drivers.to_json(orient='records').encode()
+        + b',"constructors":' + constructors.to_json(orient='records').encode()
+        + b',"progression":' + driver_progress.to_json(orient='records').encode()
+        + b',"constructor_progression":' + team_progress.to_json(orient='records').encode()
+        + b'}'
+    )
+
+    # Recomputing the current season only loads rounds newer than the stored partials
+    return body, ttl_for_season(year)
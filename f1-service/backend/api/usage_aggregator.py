@@ -0,0 +1,111 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+import threading
+import time
+import uuid
+from .sketch import bin_index
+
+SUMMARY_TYPE = 'usage_summary'
+
+# Windows are aligned to wall-clock time in the zone the raw events use
+USAGE_TIMEZONE = ZoneInfo("America/Chicago")
+
+GroupKey = Tuple[str, str, int]
+
+
+@dataclass
+class UsageGroup:
+    """Running totals of one (endpoint, method, status) within a window"""
+    count: int = 0
+    sum_ms: float = 0.0
+    min_ms: Optional[float] = None
+    max_ms: Optional[float] = None
+    bins: Dict[int, int] = field(default_factory=dict)
+
+    def add(self, response_time: float) -> None:
+        self.count += 1
+        if response_time is None:
+            return
+
+        self.sum_ms += response_time
+        self.min_ms = response_time if self.min_ms is None else min(self.min_ms, response_time)
+        self.max_ms = response_time if self.max_ms is None else max(self.max_ms, response_time)
+
+        # Negative response times mark requests without a measured latency, they stay out of the sketch
+        if response_time >= 0:
+            index = bin_index(response_time)
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+
+class UsageAggregator:
+    """Folds usage events into fixed windows, producing one summary message per closed window"""
+
+    def __init__(self, service: str, window_seconds: int) -> None:
+        self.service = service
+        self.window_seconds = window_seconds
+        self._windows: Dict[int, Dict[GroupKey, UsageGroup]] = {}
+        self._lock = threading.Lock()
+        self.events = 0
+        self.summaries = 0
+
+    def _window_id(self, now: float) -> int:
+        return int(now // self.window_seconds)
+
+    def add(self, endpoint: str, method: str, status_code: int, response_time: float) -> None:
+        window_id = self._window_id(time.time())
+        key = (endpoint, method, status_code)
+        with self._lock:
+            groups = self._windows.setdefault(window_id, {})
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = UsageGroup()
+            group.add(response_time)
+            self.events += 1
+
+    def drain(self, include_open: bool = False) -> List[dict]:
+        """Summaries of every closed window, and of the current one too when shutting down"""
+        current = self._window_id(time.time())
+        with self._lock:
+            ready = [w for w in self._windows if include_open or w < current]
+            drained = [(w, self._windows.pop(w)) for w in sorted(ready)]
+
+        summaries = [self._summary(window_id, groups) for window_id, groups in drained if groups]
+        self.summaries += len(summaries)
+        return summaries
+
+    def _summary(self, window_id: int, groups: Dict[GroupKey, UsageGroup]) -> dict:
+        window_start = datetime.fromtimestamp(window_id * self.window_seconds, USAGE_TIMEZONE)
+        return {
+            "type": SUMMARY_TYPE,
+            # Lets the stats service apply a redelivered summary only once
+            "summary_id": str(uuid.uuid4()),
+            "service": self.service,
+            "window_start": window_start.isoformat(),
+            "window_seconds": self.window_seconds,
+            "groups": [
+                {
+                    "endpoint": endpoint,
+                    "method": method,
+                    "status_code": status_code,
+                    "count": group.count,
+                    "sum_ms": group.sum_ms,
+                    "min_ms": group.min_ms,
+                    "max_ms": group.max_ms,
+                    # JSON object keys are strings, the consumer converts them back
+                    "bins": {str(index): count for index, count in group.bins.items()},
+                }
+                for (endpoint, method, status_code), group in sorted(groups.items())
+            ],
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            open_windows = len(self._windows)
+        return {
+            "window_seconds": self.window_seconds,
+            "events": self.events,
+            "summaries": self.summaries,
+            "open_windows": open_windows,
+        }
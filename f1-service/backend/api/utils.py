@@ -1,68 +1,108 @@
-from fastapi import Request
-import time
-from .kafka_producer import kafka_producer
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional, Tuple
 import pandas as pd
 import fastf1
+import os
 
-async def usage_tracking_middleware(request: Request, call_next):
-    """Middleware to track API usage and send to Kafka"""
-    start_time = time.time()
-    
-    response = await call_next(request)
-    
-    response_time = (time.time() - start_time) * 1000
-    query_params = dict(request.query_params)
-    
-    kafka_producer.send_usage_event(
-        endpoint=request.url.path,
-        method=request.method,
-        status_code=response.status_code,
-        response_time=response_time,
-        user_agent=request.headers.get('user-agent'),
-        query_params=query_params
-    )
-    
-    return response
+# Sessions other than the race that can add points to a weekend, by FastF1 identifier.
+# Only the ones an event's format actually schedules are loaded.
+SPRINT_SESSION_NAMES = {
+    'S': 'Sprint',
+    'SS': 'Sprint Shootout',
+    'SQ': 'Sprint Qualifying',
+}
+NON_SPRINT_FORMATS = ('conventional', 'testing')
 
-def aggregate_weekend(year: int, round: int) -> pd.DataFrame:
-    """Sum the total points gained by each driver over a race weekend"""
+# Separate from the request load pool, since weekend aggregation already runs on that pool
+F1_SESSION_WORKERS = int(os.getenv('F1_SESSION_WORKERS', '8'))
+session_executor = ThreadPoolExecutor(max_workers=F1_SESSION_WORKERS, thread_name_prefix='fastf1-session')
+
+# A weekend's race load and its sprint session loads by identifier
+WeekendLoads = Tuple[Future, Dict[str, Future]]
+
+def get_race_start(year: int, round: int) -> Optional[datetime]:
+    """Look up the scheduled UTC start of the race for a given round"""
 
     schedule = fastf1.get_event_schedule(year)
     event_row = schedule[schedule['RoundNumber'] == int(round)]
-    
+
     if event_row.empty:
-        return pd.DataFrame()
+        return None
+
+    event = event_row.iloc[0]
+    if 'Session5DateUtc' in event:
+        return event['Session5DateUtc']
+
+    return event['EventDate']
+
+def load_session_results(year: int, event_name: str, session_id: str) -> pd.DataFrame:
+    """Load only the classification of a single session"""
+    session = fastf1.get_session(year, event_name, session_id)
+    session.load(laps=False, telemetry=False, weather=False, messages=False, livedata=False)
+    return session.results
+
+def weekend_sprint_sessions(event: pd.Series) -> list:
+    """FastF1 identifiers of the sprint sessions an event actually has"""
+    if event.get('EventFormat') in NON_SPRINT_FORMATS:
+        return []
+
+    scheduled = {event.get(f'Session{i}') for i in range(1, 6)}
+    return [session_id for session_id, name in SPRINT_SESSION_NAMES.items() if name in scheduled]
+
+def submit_weekend(year: int, round: int) -> Optional[WeekendLoads]:
+    """Start loading a weekend's race and sprint sessions on the session pool, None if there is no such round"""
+
+    schedule = fastf1.get_event_schedule(year)
+    event_row = schedule[schedule['RoundNumber'] == int(round)]
     
-    eventName = event_row.iloc[0]['EventName']
+    if event_row.empty:
+        return None
     
-    sprint_sessions = ['S', 'SS', 'SQ']
-    weekend_data_df = pd.DataFrame()
+    event = event_row.iloc[0]
+    eventName = event['EventName']
 
-    session = fastf1.get_session(year, eventName, 'R')
-    session.load(laps=False, telemetry=False, weather=False, messages=False, livedata=False)
-    results = session.results
-    weekend_data_df = results.copy()
+    # Load the race and every sprint session concurrently
+    race_future = session_executor.submit(load_session_results, year, eventName, 'R')
+    sprint_futures = {
+        session_id: session_executor.submit(load_session_results, year, eventName, session_id)
+        for session_id in weekend_sprint_sessions(event)
+    }
+    return race_future, sprint_futures
 
-    for session_id in sprint_sessions:
+def weekend_points(loads: Optional[WeekendLoads]) -> pd.DataFrame:
+    """Wait for a weekend's session loads and sum each driver's points"""
+    if loads is None:
+        return pd.DataFrame()
+
+    race_future, sprint_futures = loads
+    weekend_data_df = race_future.result().copy()
+
+    sprint_points = []
+    for session_id, future in sprint_futures.items():
         try:
-            session = fastf1.get_session(year, eventName, session_id)
-            session.load(laps=False, telemetry=False, weather=False, messages=False, livedata=False)
-            sprint_results = session.results
-            
-            for idx, sprint_row in sprint_results.iterrows():
-                driver_id = sprint_row['DriverId']
-                sprint_points = sprint_row['Points']
-                
-                driver_mask = weekend_data_df['DriverId'] == driver_id
-                if driver_mask.any():
-                    weekend_data_df.loc[driver_mask, 'Points'] += sprint_points
-                    
+            sprint_points.append(future.result()[['DriverId', 'Points']])
         except Exception as e:
             print(f"Could not load session {session_id}: {e}")
 
     if weekend_data_df.empty:
         return pd.DataFrame()
 
+    if sprint_points:
+        points_by_driver = pd.concat(sprint_points).groupby('DriverId')['Points'].sum()
+        weekend_data_df['Points'] = weekend_data_df['Points'] + weekend_data_df['DriverId'].map(points_by_driver).fillna(0)
+
     weekend_data_df = weekend_data_df.sort_values(by='Points', ascending=False).reset_index(drop=True)
 
-    return weekend_data_df
\ No newline at end of file
+    return weekend_data_df
+
+def cancel_weekend(loads: Optional[WeekendLoads]) -> None:
+    """Drop a weekend's session loads that have not started yet"""
+    if loads is not None:
+        race_future, sprint_futures = loads
+        for future in (race_future, *sprint_futures.values()):
+            future.cancel()
+
+def aggregate_weekend(year: int, round: int) -> pd.DataFrame:
+    """Sum the total points gained by each driver over a race weekend"""
+    return weekend_points(submit_weekend(year, round))
@@ -0,0 +1,300 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import fastf1
+import pandas as pd
+from .concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# FastF1 Cache Configuration
+FASTF1_CACHE_DIR = os.getenv('FASTF1_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fastf1'))
+FASTF1_WARMUP_ENABLED = os.getenv('FASTF1_WARMUP_ENABLED', 'true').lower() == 'true'
+# Number of most recent events whose sessions are loaded on startup
+FASTF1_WARMUP_RECENT_EVENTS = int(os.getenv('FASTF1_WARMUP_RECENT_EVENTS', '2'))
+
+# Prefetch sessions once their data is likely published, retrying while it is not
+FASTF1_PREFETCH_DELAY_MINUTES = int(os.getenv('FASTF1_PREFETCH_DELAY_MINUTES', '30'))
+FASTF1_PREFETCH_RETRY_MINUTES = int(os.getenv('FASTF1_PREFETCH_RETRY_MINUTES', '30'))
+FASTF1_PREFETCH_MAX_ATTEMPTS = int(os.getenv('FASTF1_PREFETCH_MAX_ATTEMPTS', '4'))
+
+# Rough session lengths, the schedule only has start times
+RACE_DURATION = timedelta(hours=2)
+SESSION_DURATION = timedelta(hours=1)
+RACE_SESSION_NAMES = ('Race', 'Sprint')
+
+# Re-read the schedule at least this often so date changes are picked up
+SCHEDULE_REFRESH_SECONDS = 6 * 3600
+
+# With several workers only the one holding this lock warms and prefetches, and it
+# publishes its progress for the others to report
+LEADER_LOCK_PATH = os.path.join(FASTF1_CACHE_DIR, '.warmup.lock')
+STATUS_PATH = os.path.join(FASTF1_CACHE_DIR, '.warmup-status.json')
+
+
+def enable_cache() -> None:
+    """Point FastF1 at a persistent cache directory, creating it if needed"""
+    os.makedirs(FASTF1_CACHE_DIR, exist_ok=True)
+    fastf1.Cache.enable_cache(FASTF1_CACHE_DIR)
+
+
+def cache_size_bytes() -> int:
+    total = 0
+    for root, _, files in os.walk(FASTF1_CACHE_DIR):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+@dataclass
+class ScheduledSession:
+    year: int
+    round: int
+    name: str
+    ends_at: datetime
+
+    def label(self) -> str:
+        return f"{self.year} round {self.round} {self.name}"
+
+
+def session_end(name: str, start_utc: datetime) -> datetime:
+    return start_utc + (RACE_DURATION if name in RACE_SESSION_NAMES else SESSION_DURATION)
+
+
+def scheduled_sessions(year: int) -> List[ScheduledSession]:
+    """Every session of a season with its estimated UTC end, oldest first"""
+    schedule = fastf1.get_event_schedule(year, include_testing=False)
+
+    sessions = []
+    for _, event in schedule.iterrows():
+        for i in range(1, 6):
+            name = event.get(f'Session{i}')
+            start = event.get(f'Session{i}DateUtc')
+            if not name or pd.isna(start):
+                continue
+            sessions.append(ScheduledSession(
+                year=year,
+                round=int(event['RoundNumber']),
+                name=name,
+                ends_at=session_end(name, pd.Timestamp(start).to_pydatetime()),
+            ))
+    return sorted(sessions, key=lambda s: s.ends_at)
+
+
+def load_session_data(session: ScheduledSession) -> bool:
+    """Load a session the same way the API does, returning whether results were published"""
+    f1_session = fastf1.get_session(session.year, session.round, session.name)
+    f1_session.load(telemetry=False, weather=False, messages=False, livedata=False)
+    return f1_session.results is not None and not f1_session.results.empty
+
+
+def recent_sessions(now: datetime, recent_events: int) -> List[ScheduledSession]:
+    """Finished sessions of the last few events, looking back into last season if needed"""
+    finished = [s for s in scheduled_sessions(now.year) if s.ends_at <= now]
+    if not finished:
+        finished = scheduled_sessions(now.year - 1)
+
+    rounds = sorted({s.round for s in finished})[-recent_events:]
+    return [s for s in finished if s.round in rounds]
+
+
+class CacheWarmer:
+    """Fills the FastF1 disk cache on startup and prefetches sessions as they finish"""
+
+    def __init__(self) -> None:
+        self.state = "idle"
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.prefetched = 0
+        self.prefetch_failed = 0
+        self.next_prefetch: Optional[ScheduledSession] = None
+        self._tasks: List[asyncio.Task] = []
+        self._leader_lock = None
+
+    def start(self) -> None:
+        enable_cache()
+        if not FASTF1_WARMUP_ENABLED:
+            self.state = "disabled"
+            return
+
+        if not self._acquire_leadership():
+            self.state = "standby"
+            return
+
+        # Both run in the background so startup and readiness are not delayed
+        self._tasks = [
+            asyncio.create_task(self._warm_up()),
+            asyncio.create_task(self._prefetch_loop()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._leader_lock is not None:
+            self._leader_lock.close()
+            self._leader_lock = None
+
+    def _acquire_leadership(self) -> bool:
+        """Take the machine-wide warm-up lock without waiting, held until stop()"""
+        lock_file = open(LEADER_LOCK_PATH, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._leader_lock = lock_file
+        return True
+
+    def _publish(self) -> None:
+        """Share progress with standby workers"""
+        tmp_path = f"{STATUS_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._own_stats(), f)
+            os.replace(tmp_path, STATUS_PATH)
+        except OSError as e:
+            logger.warning(f"Could not publish warm-up status: {e}")
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ("done", "disabled")
+
+    async def _warm_up(self) -> None:
+        self.state = "running"
+        self.started_at = time.time()
+        try:
+            sessions = await run_blocking(recent_sessions, datetime.utcnow(), FASTF1_WARMUP_RECENT_EVENTS)
+            self.total = len(sessions)
+            self._publish()
+
+            # One session at a time, leaving the rest of the load pool to requests
+            for session in sessions:
+                try:
+                    await run_blocking(load_session_data, session)
+                    self.completed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning(f"Warm-up could not load {session.label()}: {e}")
+                self._publish()
+
+            self.state = "done"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.state = "failed"
+            logger.error(f"FastF1 cache warm-up failed: {e}")
+        finally:
+            self.finished_at = time.time()
+            self._publish()
+
+    async def _prefetch_loop(self) -> None:
+        delay = timedelta(minutes=FASTF1_PREFETCH_DELAY_MINUTES)
+        # Sessions that finished before startup are the warm-up's job
+        started = datetime.utcnow()
+        handled = set()
+
+        while True:
+            try:
+                now = datetime.utcnow()
+                sessions = await run_blocking(scheduled_sessions, now.year)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Prefetch could not read the schedule: {e}")
+                await asyncio.sleep(FASTF1_PREFETCH_RETRY_MINUTES * 60)
+                continue
+
+            upcoming = [s for s in sessions if s.ends_at + delay > started and s.label() not in handled]
+            if not upcoming:
+                # Season over, check again later for next year's schedule
+                self.next_prefetch = None
+                await asyncio.sleep(SCHEDULE_REFRESH_SECONDS)
+                continue
+
+            session = upcoming[0]
+            self.next_prefetch = session
+            self._publish()
+            wait_seconds = (session.ends_at + delay - now).total_seconds()
+            if wait_seconds > SCHEDULE_REFRESH_SECONDS:
+                await asyncio.sleep(SCHEDULE_REFRESH_SECONDS)
+                continue
+
+            await asyncio.sleep(max(0, wait_seconds))
+            await self._prefetch(session)
+            handled.add(session.label())
+            self._publish()
+
+    async def _prefetch(self, session: ScheduledSession) -> None:
+        """Load a finished session, retrying until its results are published"""
+        for attempt in range(1, FASTF1_PREFETCH_MAX_ATTEMPTS + 1):
+            try:
+                if await run_blocking(load_session_data, session):
+                    self.prefetched += 1
+                    logger.info(f"Prefetched {session.label()}")
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Prefetch of {session.label()} failed: {e}")
+
+            if attempt < FASTF1_PREFETCH_MAX_ATTEMPTS:
+                await asyncio.sleep(FASTF1_PREFETCH_RETRY_MINUTES * 60)
+
+        self.prefetch_failed += 1
+
+    def stats(self) -> dict:
+        if self.state == "standby":
+            try:
+                with open(STATUS_PATH) as f:
+                    return {**json.load(f), "worker": "standby"}
+            except (OSError, ValueError):
+                pass
+        return {**self._own_stats(), "worker": "leader" if self._leader_lock else self.state}
+
+    def _own_stats(self) -> dict:
+        next_prefetch = None
+        if self.next_prefetch is not None:
+            next_prefetch = {
+                "session": self.next_prefetch.label(),
+                "due_at": (self.next_prefetch.ends_at
+                           + timedelta(minutes=FASTF1_PREFETCH_DELAY_MINUTES)).isoformat() + "Z",
+            }
+
+        return {
+            "ready": self.ready,
+            "cache_dir": FASTF1_CACHE_DIR,
+            "warmup": {
+                "state": self.state,
+                "total": self.total,
+                "completed": self.completed,
+                "failed": self.failed,
+                "duration_seconds": round((self.finished_at or time.time()) - self.started_at, 1)
+                if self.started_at else None,
+            },
+            "prefetch": {
+                "next": next_prefetch,
+                "prefetched": self.prefetched,
+                "failed": self.prefetch_failed,
+            },
+        }
+
+
+# Global warmer instance
+cache_warmer = CacheWarmer()
@@ -0,0 +1,93 @@
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import msgpack
+from .usage_aggregator import SUMMARY_TYPE, USAGE_TIMEZONE
+
+# Kafka header naming the encoding of a record on the api-usage topic. Records without
+# it are single JSON events or summaries, which the stats consumer still accepts.
+FORMAT_HEADER = 'usage-format'
+MSGPACK_BATCH_V2 = b'msgpack-batch/2'
+
+JSON_FORMAT = 'json'
+MSGPACK_FORMAT = 'msgpack'
+WIRE_FORMATS = (JSON_FORMAT, MSGPACK_FORMAT)
+
+# Kafka rejects records above max.request.size (1 MB by default), larger batches are split
+MAX_RECORD_BYTES = 900 * 1024
+
+
+def event_timestamp(timestamp_ms: int) -> str:
+    """Chicago wall-clock ISO timestamp of the legacy JSON events"""
+    return datetime.fromtimestamp(timestamp_ms / 1000, USAGE_TIMEZONE).isoformat()
+
+
+def encode_json(item: dict) -> bytes:
+    """One queued event or summary as a legacy JSON record"""
+    if item.get('type') != SUMMARY_TYPE:
+        item = dict(item)
+        item['event_id'] = str(item['event_id'])
+        item['timestamp'] = event_timestamp(item.pop('timestamp_ms'))
+    return json.dumps(item).encode('utf-8')
+
+
+def _encode_batch(service: str, items: List[dict]) -> bytes:
+    """Version 2 batch layout, version 1 had no event ids
+
+    s    service name
+    t0   epoch ms of the earliest event
+    str  strings referenced by index from the events (endpoints, methods, user agents)
+    e    events as [endpoint, method, status_code, response_time_ms, ms after t0,
+         user_agent or None, query_params or None, sampled, 16 byte event id]
+    sum  window summaries, unchanged
+    """
+    strings: Dict[str, int] = {}
+
+    def intern(value: Optional[str]) -> Optional[int]:
+        if value is None:
+            return None
+        code = strings.get(value)
+        if code is None:
+            code = strings[value] = len(strings)
+        return code
+
+    events = [item for item in items if item.get('type') != SUMMARY_TYPE]
+    base_ms = min((event['timestamp_ms'] for event in events), default=0)
+    return msgpack.packb({
+        "s": service,
+        "t0": base_ms,
+        "e": [
+            [
+                intern(event['endpoint']),
+                intern(event['method']),
+                event['status_code'],
+                event['response_time_ms'],
+                event['timestamp_ms'] - base_ms,
+                intern(event.get('user_agent')),
+                event.get('query_params') or None,
+                bool(event.get('sampled')),
+                event['event_id'].bytes,
+            ]
+            for event in events
+        ],
+        "sum": [item for item in items if item.get('type') == SUMMARY_TYPE],
+        # Filled last so every string above has its code
+        "str": list(strings),
+    })
+
+
+def encode_batches(service: str, items: List[dict]) -> Iterator[Tuple[List[dict], bytes]]:
+    """Queued events and summaries as msgpack batch records, split to stay under MAX_RECORD_BYTES.
+
+    Each record comes with the items it holds, so delivery failures can be traced back to them.
+    """
+    if not items:
+        return
+    payload = _encode_batch(service, items)
+    if len(payload) <= MAX_RECORD_BYTES or len(items) == 1:
+        yield items, payload
+        return
+
+    middle = len(items) // 2
+    yield from encode_batches(service, items[:middle])
+    yield from encode_batches(service, items[middle:])
@@ -1,7 +1,12 @@
+// Query string suffix asking the API for only the given columns
+function fieldsParam(fields?: string[]): string {
+    return fields && fields.length ? `&fields=${encodeURIComponent(fields.join(','))}` : '';
+}
+
 
 // Fetch the Schedule for a Given Year
-export async function fetchSchedule(year: number): Promise<any> {
-    const response = await fetch(`/api/schedule?year=${year}`);
+export async function fetchSchedule(year: number, fields?: string[]): Promise<any> {
+    const response = await fetch(`/api/schedule?year=${year}${fieldsParam(fields)}`);
     if (!response.ok) {
         throw new Error(`Error fetching schedule for year ${year}: ${response.statusText}`);
     } else {
@@ -11,8 +16,8 @@ export async function fetchSchedule(year: number): Promise<any> {
 }
 
 // Fetch Weekend Results for a Given Year and Round
-export async function fetchWeekendResults(year: number, round: number | string): Promise<any> {
-    const response = await fetch(`/api/weekend-results?year=${year}&round=${round}`);
+export async function fetchWeekendResults(year: number, round: number | string, fields?: string[]): Promise<any> {
+    const response = await fetch(`/api/weekend-results?year=${year}&round=${round}${fieldsParam(fields)}`);
     if (!response.ok) {
         throw new Error(`Error fetching weekend results for year ${year}, round ${round}: ${response.statusText}`);
     } else {
@@ -21,13 +26,42 @@ export async function fetchWeekendResults(year: number, round: number | string):
     }
 }
 
+// Fetch Driver and Constructor Standings with their Round by Round Progression
+export async function fetchSeasonStandings(year: number): Promise<any> {
+    const response = await fetch(`/api/season-standings?year=${year}`);
+    if (!response.ok) {
+        throw new Error(`Error fetching season standings for year ${year}: ${response.statusText}`);
+    } else {
+        return await response.json();
+    }
+}
+
 // Fetch Session Info for a Given Year, Round, and Session Code
-export async function fetchSessionInfo(year: number, round: string, sessionCd: string): Promise<any> {
-    const response = await fetch(`/api/session-info?year=${year}&round=${round}&sessionCd=${sessionCd}`);
+export async function fetchSessionInfo(year: number, round: string, sessionCd: string, fields?: string[]): Promise<any> {
+    const response = await fetch(`/api/session-info?year=${year}&round=${round}&sessionCd=${sessionCd}${fieldsParam(fields)}`);
     if (!response.ok) {
         throw new Error(`Error fetching session info for event ${round}, year ${year}: ${response.statusText}`);
     } else {
         const data = await response.json();
         return data.session;
     }
-}
\ No newline at end of file
+}
+
+// Fetch Session Info for Several Sessions in One Request
+// Each result carries its own status, so one failed session does not fail the others
+export async function fetchSessionsBatch(
+    sessions: { year: number; round: number | string; sessionCd: string }[],
+    fields?: string[],
+): Promise<any[]> {
+    const response = await fetch(`/api/sessions/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sessions, fields: fields?.join(',') }),
+    });
+    if (!response.ok) {
+        throw new Error(`Error fetching ${sessions.length} sessions: ${response.statusText}`);
+    } else {
+        const data = await response.json();
+        return data.results;
+    }
+}
@@ -3,6 +3,9 @@ import { fetchSchedule } from '../api/api.hub';
 import { ScheduleEvent } from '../models/models';
 import { Header, Footer } from '../components/index';
 
+// Columns rendered on the event cards
+const SCHEDULE_FIELDS = ['RoundNumber', 'EventName', 'Location', 'Country', 'EventDate', 'EventFormat', 'Session5'];
+
 export function Schedule() {
     const [schedule, setSchedule] = useState<ScheduleEvent[]>([]);
     const [loading, setLoading] = useState(true);
@@ -18,7 +21,7 @@ export function Schedule() {
         setError(null);
         
         try {
-            const schedule = await fetchSchedule(selectedYear);
+            const schedule = await fetchSchedule(selectedYear, SCHEDULE_FIELDS);
             setSchedule(schedule);
         } catch (err) {
             setError(err instanceof Error ? err.message : 'An error occurred');
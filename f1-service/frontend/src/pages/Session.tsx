@@ -5,6 +5,13 @@ import React from "react";
 import { ScheduleEvent, DriverResult } from "../models/models";
 import { parse } from "tinyduration";
 
+// Columns rendered by the event picker and the results table
+const SCHEDULE_FIELDS = ['RoundNumber', 'EventName', 'Session1', 'Session2', 'Session3', 'Session4', 'Session5'];
+const RESULT_FIELDS = [
+    'DriverId', 'Position', 'HeadshotUrl', 'FullName', 'BroadcastName', 'Abbreviation',
+    'TeamColor', 'TeamName', 'Time', 'Q1', 'Q2', 'Q3', 'Status', 'Points', 'Laps',
+];
+
 function getSessionCode(sessionName: string): string {
     const mapping: { [key: string]: string } = {
         "Race": "R",
@@ -84,7 +91,7 @@ export function SessionPage() {
             setLoading(true);
             setError(null);
             try {
-                const events = await fetchSchedule(year);
+                const events = await fetchSchedule(year, SCHEDULE_FIELDS);
                 setSchedule(events);
                 setSelectedEvent(null);
                 setSelectedSessionCode("");
@@ -106,7 +113,7 @@ export function SessionPage() {
                 setError(null);
                 try {
                     const round = event.EventName
-                    const data = await fetchSessionInfo(year, round, selectedSessionCode);
+                    const data = await fetchSessionInfo(year, round, selectedSessionCode, RESULT_FIELDS);
                     setSessionInfo(data);
                 } catch (err) {
                     setError(err instanceof Error ? err.message : "Failed to load session info");
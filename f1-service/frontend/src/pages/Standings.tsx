@@ -1,8 +1,18 @@
 import React, { useEffect, useState } from 'react';
-import { fetchSchedule, fetchWeekendResults } from '../api/api.hub';
+import { fetchSchedule, fetchSeasonStandings } from '../api/api.hub';
 import { ScheduleEvent, DriverResult } from '../models/models';
 import { Header, Footer } from "../components/index"
 
+// Columns the standings chart is built from
+const SCHEDULE_FIELDS = ['RoundNumber', 'EventDate'];
+
+interface ProgressionEntry {
+  Round: number;
+  DriverId: string;
+  CumulativePoints: number;
+  Position: number;
+}
+
 interface DriverStanding {
   driverId: string;
   abbreviation: string;
@@ -26,7 +36,7 @@ export function Standings() {
     setLoading(true);
     setError(null);
     try {
-      const scheduleData: ScheduleEvent[] = await fetchSchedule(year);
+      const scheduleData: ScheduleEvent[] = await fetchSchedule(year, SCHEDULE_FIELDS);
       const today = new Date();
       const completedEvents = scheduleData.filter(event => {
         const eventDate = new Date(event.EventDate);
@@ -35,54 +45,32 @@ export function Standings() {
 
       setSchedule(completedEvents);
 
+      // Cumulative points and positions after every round, computed by the server
+      const standings = await fetchSeasonStandings(year);
+      const progression: ProgressionEntry[] = standings.progression;
+      const drivers: Map<string, Partial<DriverResult>> = new Map(
+        standings.drivers.map((driver: Partial<DriverResult>) => [driver.DriverId, driver])
+      );
+
       const driverPointsMap: Map<string, {
         info: Partial<DriverResult>;
         positions: { round: number; position: number; cumulativePoints: number }[];
-        cumulativePoints: number;
       }> = new Map();
 
-      for (const event of completedEvents) {
-
-        // Skip Pre-Season Testing
-        if (event.RoundNumber === 0) {
-          continue;
-        }
-        
-        try {
-          const results: DriverResult[] = await fetchWeekendResults(year, event.RoundNumber);
-          
-          const driversInThisRound = new Set<string>();
-  
-          results.forEach((result) => {
-            driversInThisRound.add(result.DriverId);
-            
-            if (!driverPointsMap.has(result.DriverId)) {
-              driverPointsMap.set(result.DriverId, {
-                info: result,
-                positions: [],
-                cumulativePoints: 0,
-              });
-            }
-
-            const driverData = driverPointsMap.get(result.DriverId)!;
-            driverData.cumulativePoints += result.Points;
-          });
-
-          const sortedDrivers = Array.from(driverPointsMap.entries())
-            .filter(([driverId, data]) => data.positions.length > 0 || driversInThisRound.has(driverId))
-            .sort((a, b) => b[1].cumulativePoints - a[1].cumulativePoints);
-
-          sortedDrivers.forEach(([driverId, data], index) => {
-            data.positions.push({
-              round: event.RoundNumber,
-              position: index + 1,
-              cumulativePoints: data.cumulativePoints,
-            });
+      progression.forEach((entry) => {
+        if (!driverPointsMap.has(entry.DriverId)) {
+          driverPointsMap.set(entry.DriverId, {
+            info: drivers.get(entry.DriverId) || {},
+            positions: [],
           });
-        } catch (err) {
-          console.error(`Error fetching results for round ${event.RoundNumber}:`, err);
         }
-      }
+
+        driverPointsMap.get(entry.DriverId)!.positions.push({
+          round: entry.Round,
+          position: entry.Position,
+          cumulativePoints: entry.CumulativePoints,
+        });
+      });
 
       const standingsArray: DriverStanding[] = Array.from(driverPointsMap.entries())
         .filter(([driverId, data]) => {
@@ -1,14 +1,22 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from .models import Role, UserRegister, UserLogin, Token, UserResponse
-from .auth import get_current_user, require_role, get_password_hash, verify_password, create_access_token
+from .models import Principal, Role, UserRegister, UserLogin, Token, UserResponse
+from .auth import get_current_user, require_role, get_password_hash, get_password_hash_async, verify_password_async, create_access_token, hash_executor
+from .ratelimit import throttle_attempt, username_throttle
 import uvicorn
 import os
-from .kafka_consumer import kafka_consumer
-from .database import get_db, APIUsage, init_db, User
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from .kafka_consumer import EMBEDDED_MODE, KAFKA_CONSUMER_MODE, kafka_consumer
+from .partitions import partition_maintainer
+from .database import get_db, get_async_db, async_engine, pool_wait_stats, APIUsage, APIUsageLatencyBin, APIUsageRollup, init_db, User
+from .rollups import GRANULARITIES, DAY, HOUR, latency_bin_range
+from .sketch import LatencySketch
+from .events import MAX_PAGE_SIZE, EVENT_COLUMNS, as_naive, decode_cursor, encode_cursor, event_filters, event_to_dict, export_csv, export_ndjson
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, literal_column, select, tuple_
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -41,12 +49,18 @@ async def lifespan(app: FastAPI):
     else:
         print("Skipping admin user creation.")
     
-    kafka_consumer.start()
+    # In external mode ingestion runs in separate consumer_runner processes
+    if KAFKA_CONSUMER_MODE == EMBEDDED_MODE:
+        kafka_consumer.start()
+    partition_maintainer.start()
     yield
 
     # Shutdown
     print("Stats Service shutting down...")
+    partition_maintainer.stop()
     kafka_consumer.stop()
+    hash_executor.shutdown(wait=False, cancel_futures=True)
+    await async_engine.dispose()
 
 app = FastAPI(title="Stats Service API", version="1.0.0", lifespan=lifespan)
 
@@ -65,23 +79,25 @@ async def root():
 
 # Authentication endpoints
 @app.post("/api/auth/register", response_model=UserResponse)
-async def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Register a new user"""
+    throttle_attempt(request)
+
     # Check if user already exists
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
+    existing_user = (await db.execute(select(User).where(User.username == user_data.username))).scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # Create new user (all registered users are regular users by default)
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     new_user = User(
         username=user_data.username,
         hashed_password=hashed_password,
         role=Role.USER
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return UserResponse(
         id=new_user.id,
         username=new_user.username,
@@ -89,19 +105,23 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     )
 
 @app.post("/api/auth/login", response_model=Token)
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login(user_data: UserLogin, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Login and get JWT token"""
-    user = db.query(User).filter(User.username == user_data.username).first()
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    throttle_attempt(request, user_data.username)
+
+    user = (await db.execute(select(User).where(User.username == user_data.username))).scalars().first()
+    if not user or not await verify_password_async(user_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
-    
+
+    username_throttle.reset(user.username)
+
     access_token = create_access_token(
-        data={"sub": user.username, "role": user.role.value}
+        data={"sub": user.username, "uid": user.id, "role": user.role.value}
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/api/auth/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: Principal = Depends(get_current_user)):
     """Get current user information"""
     return UserResponse(
         id=current_user.id,
@@ -112,12 +132,17 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 # Stats Endpoints
 @app.get("/api/usage/summary")
 async def get_usage_summary(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_role([Role.ADMIN]))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
 ):
     """Get summary of API usage"""
-    total_requests = db.query(func.count(APIUsage.id)).scalar()
-    avg_response_time = db.query(func.avg(APIUsage.response_time_ms)).scalar()
+    total_requests, total_response_time = (await db.execute(
+        select(
+            func.coalesce(func.sum(APIUsageRollup.request_count), 0),
+            func.sum(APIUsageRollup.response_time_sum_ms)
+        ).where(APIUsageRollup.granularity == HOUR)
+    )).one()
+    avg_response_time = total_response_time / total_requests if total_requests else None
     
     return {
         "total_requests": total_requests,
@@ -126,21 +151,132 @@ async def get_usage_summary(
 
 @app.get("/api/usage/by-endpoint")
 async def get_usage_by_endpoint(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_role([Role.ADMIN]))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
 ):
     """Get usage statistics grouped by endpoint"""
-    results = db.query(
-        APIUsage.endpoint,
-        func.count(APIUsage.id).label('count'),
-        func.avg(APIUsage.response_time_ms).label('avg_response_time')
-    ).group_by(APIUsage.endpoint).all()
+    results = (await db.execute(
+        select(
+            APIUsageRollup.endpoint,
+            func.sum(APIUsageRollup.request_count).label('count'),
+            func.sum(APIUsageRollup.response_time_sum_ms).label('response_time_sum')
+        ).where(APIUsageRollup.granularity == HOUR).group_by(APIUsageRollup.endpoint)
+    )).all()
     
     return [
         {
             "endpoint": r.endpoint,
             "request_count": r.count,
-            "avg_response_time_ms": round(r.avg_response_time, 2)
+            "avg_response_time_ms": round(r.response_time_sum / r.count, 2)
+        }
+        for r in results
+    ]
+
+@app.get("/api/usage/latency")
+async def get_usage_latency(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    endpoint: Optional[str] = None,
+    interval: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
+):
+    """Get latency percentiles per endpoint, merged from the stored latency sketches"""
+    if interval not in (None, HOUR, DAY):
+        raise HTTPException(status_code=400, detail=f"interval must be one of {HOUR}, {DAY}")
+    start, end = as_naive(start), as_naive(end)
+
+    bin_columns = [APIUsageLatencyBin.endpoint]
+    max_columns = [APIUsageRollup.endpoint]
+    if interval:
+        bin_columns.insert(0, func.date_trunc(literal_column(f"'{interval}'"), APIUsageLatencyBin.bucket_start).label('window_start'))
+        max_columns.insert(0, func.date_trunc(literal_column(f"'{interval}'"), APIUsageRollup.bucket_start).label('window_start'))
+
+    bins_query = select(
+        *bin_columns,
+        APIUsageLatencyBin.bin,
+        func.sum(APIUsageLatencyBin.count).label('count')
+    ).where(latency_bin_range(start, end, hourly=interval == HOUR))
+
+    max_query = select(
+        *max_columns,
+        func.max(APIUsageRollup.response_time_max_ms).label('max')
+    ).where(APIUsageRollup.granularity == HOUR)
+
+    if start:
+        max_query = max_query.where(APIUsageRollup.bucket_start >= start)
+    if end:
+        max_query = max_query.where(APIUsageRollup.bucket_start < end)
+    if endpoint:
+        bins_query = bins_query.where(APIUsageLatencyBin.endpoint == endpoint)
+        max_query = max_query.where(APIUsageRollup.endpoint == endpoint)
+
+    sketches = {}
+    for r in (await db.execute(bins_query.group_by(*bin_columns, APIUsageLatencyBin.bin))).all():
+        key = (r.window_start if interval else None, r.endpoint)
+        sketches.setdefault(key, LatencySketch()).add_bin(r.bin, r.count)
+
+    maxima = {
+        (r.window_start if interval else None, r.endpoint): r.max
+        for r in (await db.execute(max_query.group_by(*max_columns))).all()
+    }
+
+    results = []
+    for key in sorted(sketches, key=lambda k: (k[0] or datetime.min, k[1])):
+        window, endpoint_name = key
+        sketch = sketches[key]
+        result = {
+            "endpoint": endpoint_name,
+            "request_count": sketch.count,
+            **sketch.percentiles(),
+            "max": maxima.get(key),
+        }
+        if interval:
+            result["window_start"] = window.isoformat()
+        results.append(result)
+
+    return results
+
+@app.get("/api/usage/timeseries")
+async def get_usage_timeseries(
+    granularity: str = HOUR,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    endpoint: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
+):
+    """Get request counts and latency per minute or hour bucket"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    start, end = as_naive(start), as_naive(end)
+
+    query = select(
+        APIUsageRollup.bucket_start,
+        func.sum(APIUsageRollup.request_count).label('count'),
+        func.sum(APIUsageRollup.response_time_sum_ms).label('response_time_sum'),
+        func.min(APIUsageRollup.response_time_min_ms).label('response_time_min'),
+        func.max(APIUsageRollup.response_time_max_ms).label('response_time_max')
+    ).where(APIUsageRollup.granularity == granularity)
+
+    if start:
+        query = query.where(APIUsageRollup.bucket_start >= start)
+    if end:
+        query = query.where(APIUsageRollup.bucket_start < end)
+    if endpoint:
+        query = query.where(APIUsageRollup.endpoint == endpoint)
+
+    results = (await db.execute(
+        query.group_by(APIUsageRollup.bucket_start).order_by(APIUsageRollup.bucket_start)
+    )).all()
+
+    return [
+        {
+            "bucket_start": r.bucket_start.isoformat(),
+            "request_count": r.count,
+            "avg_response_time_ms": round(r.response_time_sum / r.count, 2),
+            "min_response_time_ms": r.response_time_min,
+            "max_response_time_ms": r.response_time_max
         }
         for r in results
     ]
@@ -148,11 +284,15 @@ async def get_usage_by_endpoint(
 @app.get("/api/usage/recent")
 async def get_recent_usage(
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_role([Role.ADMIN]))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
 ):
     """Get recent API usage events"""
-    usages = db.query(APIUsage).order_by(APIUsage.timestamp.desc()).limit(limit).all()
+    usages = (await db.execute(
+        select(*EVENT_COLUMNS).order_by(
+            APIUsage.timestamp.desc(), APIUsage.id.desc()
+        ).limit(min(limit, MAX_PAGE_SIZE))
+    )).all()
     
     return [
         {
@@ -166,6 +306,84 @@ async def get_recent_usage(
         for u in usages
     ]
 
+@app.get("/api/usage/events")
+async def get_usage_events(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    service: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    status_code: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
+):
+    """Page backwards through usage events, newest first, using keyset pagination"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    filters = event_filters(service, endpoint, status_code, start, end)
+
+    if cursor:
+        try:
+            cursor_timestamp, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        filters.append(tuple_(APIUsage.timestamp, APIUsage.id) < tuple_(cursor_timestamp, cursor_id))
+
+    # Fetch one extra row to know whether there is another page
+    rows = (await db.execute(
+        select(*EVENT_COLUMNS).where(*filters).order_by(
+            APIUsage.timestamp.desc(), APIUsage.id.desc()
+        ).limit(limit + 1)
+    )).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    return {
+        "items": [event_to_dict(r) for r in rows],
+        "next_cursor": next_cursor
+    }
+
+@app.get("/api/usage/export")
+async def export_usage_events(
+    format: str = "ndjson",
+    service: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    status_code: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
+):
+    """Stream matching usage events, oldest first, as NDJSON or CSV"""
+    filters = event_filters(service, endpoint, status_code, start, end)
+
+    if format == "ndjson":
+        return StreamingResponse(export_ndjson(filters), media_type="application/x-ndjson")
+    if format == "csv":
+        return StreamingResponse(
+            export_csv(filters),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=api-usage.csv"}
+        )
+
+    raise HTTPException(status_code=400, detail="format must be one of ndjson, csv")
+
+@app.get("/api/db/pool")
+async def get_db_pool_stats(
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
+):
+    """Get connection pool usage and checkout wait times for the async database pool"""
+    return pool_wait_stats.stats()
+
+@app.get("/api/consumer")
+async def get_consumer_stats(
+    current_user: Principal = Depends(require_role([Role.ADMIN]))
+):
+    """Get per-partition lag and ingest throughput of the consumer embedded in this process"""
+    return kafka_consumer.stats()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -1,26 +1,119 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Any, Callable, Optional, List
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from .database import get_db, User
-from .models import Role
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+from .database import AsyncSessionLocal, User
+from .models import Principal, Role
+import asyncio
 import os
+import threading
+import time
 
 # JWT Configuration
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRATION_HOURS = int(os.getenv("JWT_EXPIRATION_HOURS", "24"))
 
+# Principal cache configuration
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "1024"))
+# Take the user id and role from the signed token instead of looking the user up
+AUTH_TRUST_TOKEN_ROLE = os.getenv("AUTH_TRUST_TOKEN_ROLE", "false").lower() == "true"
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is deliberately slow, so it runs on its own small pool instead of the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUED = int(os.getenv("PASSWORD_HASH_MAX_QUEUED", "16"))
+PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS", "2"))
+
+hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
 # HTTP Bearer token scheme
 security = HTTPBearer()
 
 
+class PrincipalCache:
+    """Short-lived, size-bounded cache of authenticated principals by username"""
+
+    def __init__(self, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[Principal, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0
+
+    def get(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return principal
+
+    def version(self) -> int:
+        """Taken before a lookup and passed to put, so a lookup that raced an invalidation is not cached"""
+        with self._lock:
+            return self._invalidations
+
+    def put(self, principal: Principal, version: int) -> None:
+        with self._lock:
+            if version != self._invalidations:
+                return
+            self._entries[principal.username] = (principal, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(principal.username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._entries.pop(username, None)
+
+
+principal_cache = PrincipalCache()
+
+
+# Session.info key of the usernames whose cached principal goes once the transaction commits
+CHANGED_USERS_KEY = "changed_usernames"
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _record_changed_user(mapper, connection, target: User) -> None:
+    """Remember users that are created, changed or removed until their transaction ends"""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(CHANGED_USERS_KEY, set()).add(target.username)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_cached_users(session: Session) -> None:
+    """Drop changed users' cached principals once the change is visible to other sessions.
+
+    Only this process's cache is cleared, other processes catch up within AUTH_CACHE_TTL_SECONDS.
+    """
+    for username in session.info.pop(CHANGED_USERS_KEY, ()):
+        principal_cache.invalidate(username)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session: Session) -> None:
+    session.info.pop(CHANGED_USERS_KEY, None)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -31,6 +124,65 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+class PasswordHashPool:
+    """Admission control in front of hash_executor so a login burst is rejected instead of queued forever"""
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_queued: int = PASSWORD_HASH_MAX_QUEUED,
+        queue_timeout_seconds: float = PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.queued = 0
+        self.rejected = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _busy(self) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, try again shortly",
+            headers={"Retry-After": str(max(1, round(self.queue_timeout_seconds)))},
+        )
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        if self._slots.locked() and self.queued >= self.max_queued:
+            raise self._busy()
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout_seconds)
+        except asyncio.TimeoutError:
+            raise self._busy()
+        finally:
+            self.queued -= 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(hash_executor, func, *args)
+        finally:
+            self._slots.release()
+
+
+password_hash_pool = PasswordHashPool()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the password hash pool"""
+    return await password_hash_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the password hash pool"""
+    return await password_hash_pool.run(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -56,10 +208,17 @@ def decode_token(token: str) -> dict:
         )
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
+def principal_from_claims(payload: dict) -> Optional[Principal]:
+    """Build a principal from the claims create_access_token signed, if they are all there"""
+    try:
+        return Principal(id=payload["uid"], username=payload["sub"], role=Role(payload["role"]))
+    except (KeyError, ValueError):
+        return None
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Principal:
     """Get the current authenticated user from JWT token"""
     token = credentials.credentials
     payload = decode_token(token)
@@ -70,19 +229,35 @@ def get_current_user(
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = db.query(User).filter(User.username == username).first()
+
+    if AUTH_TRUST_TOKEN_ROLE:
+        principal = principal_from_claims(payload)
+        if principal is not None:
+            return principal
+
+    principal = principal_cache.get(username)
+    if principal is not None:
+        return principal
+
+    # Only a cache miss opens a session, so cached requests never touch the pool
+    version = principal_cache.version()
+    async with AsyncSessionLocal() as db:
+        user = (await db.execute(select(User).where(User.username == username))).scalars().first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user
+
+    principal = Principal(id=user.id, username=user.username, role=user.role)
+    principal_cache.put(principal, version)
+    return principal
 
 
 def require_role(allowed_roles: List[Role]):
     """Dependency factory for role-based access control"""
-    def role_checker(current_user: User = Depends(get_current_user)) -> User:
+    async def role_checker(current_user: Principal = Depends(get_current_user)) -> Principal:
         if current_user.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,77 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+from .kafka_consumer import kafka_consumer
+from .partitions import partition_maintainer
+
+logger = logging.getLogger(__name__)
+
+# Runner Configuration
+CONSUMER_HEALTH_PORT = int(os.getenv('CONSUMER_HEALTH_PORT', '8002'))
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """GET /health answers 200 or 503 for orchestrators, GET /stats has per-partition lag and throughput"""
+
+    def do_GET(self):
+        if self.path == '/health':
+            healthy = kafka_consumer.healthy()
+            self._send_json(200 if healthy else 503, {"status": "healthy" if healthy else "unhealthy"})
+        elif self.path == '/stats':
+            self._send_json(200, kafka_consumer.stats())
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def _send_json(self, status_code: int, body: dict):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Health checks every few seconds would drown out the consumer's own logs
+        pass
+
+
+def main():
+    """Run the usage consumer as its own process, one member of the consumer group"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    kafka_consumer.start()
+    if kafka_consumer.consumer_thread is None:
+        logger.error("Kafka consumer could not be started")
+        sys.exit(1)
+
+    # Tomorrow's partitions must exist even when the API process is scaled down
+    partition_maintainer.start(run_now=True)
+
+    server = ThreadingHTTPServer(('0.0.0.0', CONSUMER_HEALTH_PORT), HealthHandler)
+    threading.Thread(target=server.serve_forever, name='consumer-health', daemon=True).start()
+    logger.info(f"Consumer health endpoint listening on port {CONSUMER_HEALTH_PORT}")
+
+    exit_code = 0
+    while not stop_event.wait(5):
+        if not kafka_consumer.consumer_thread.is_alive():
+            # Let the orchestrator restart the process instead of idling in the group
+            logger.error("Kafka consumer thread exited")
+            exit_code = 1
+            break
+
+    server.shutdown()
+    partition_maintainer.stop()
+    kafka_consumer.stop()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from sqlalchemy import select
+from .database import AsyncSessionLocal, APIUsage
+from .rollups import as_utc_naive
+import base64
+import csv
+import io
+import json
+
+MAX_PAGE_SIZE = 1000
+EXPORT_FETCH_SIZE = 1000
+
+EVENT_COLUMNS = (
+    APIUsage.id,
+    APIUsage.service,
+    APIUsage.endpoint,
+    APIUsage.method,
+    APIUsage.status_code,
+    APIUsage.response_time_ms,
+    APIUsage.timestamp,
+)
+EXPORT_FIELDS = [column.key for column in EVENT_COLUMNS]
+
+
+def encode_cursor(timestamp: datetime, event_id: int) -> str:
+    """Opaque cursor pointing just past the given (timestamp, id)"""
+    raw = f"{timestamp.isoformat()}|{event_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor, raises ValueError for malformed cursors"""
+    try:
+        timestamp, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(event_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def event_filters(
+    service: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    status_code: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> list:
+    """WHERE conditions shared by the events listing and export"""
+    start, end = as_naive(start), as_naive(end)
+
+    filters = []
+    if service:
+        filters.append(APIUsage.service == service)
+    if endpoint:
+        filters.append(APIUsage.endpoint == endpoint)
+    if status_code is not None:
+        filters.append(APIUsage.status_code == status_code)
+    if start:
+        filters.append(APIUsage.timestamp >= start)
+    if end:
+        filters.append(APIUsage.timestamp < end)
+    return filters
+
+
+def event_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "service": row.service,
+        "endpoint": row.endpoint,
+        "method": row.method,
+        "status_code": row.status_code,
+        "response_time_ms": row.response_time_ms,
+        "timestamp": row.timestamp.isoformat(),
+    }
+
+
+def as_naive(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """api_usage stores naive UTC timestamps, convert query parameters with an offset to UTC"""
+    if timestamp is None:
+        return None
+    return as_utc_naive(timestamp)
+
+
+async def _stream_rows(filters: List) -> AsyncIterator:
+    """Yield matching rows oldest first through a server-side cursor"""
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            select(*EVENT_COLUMNS)
+            .where(*filters)
+            .order_by(APIUsage.timestamp, APIUsage.id)
+        )
+        async for partition in result.partitions(EXPORT_FETCH_SIZE):
+            yield partition
+
+
+async def export_ndjson(filters: List) -> AsyncIterator[bytes]:
+    async for rows in _stream_rows(filters):
+        yield "".join(json.dumps(event_to_dict(row)) + "\n" for row in rows).encode()
+
+
+async def export_csv(filters: List) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+
+    async for rows in _stream_rows(filters):
+        for row in rows:
+            writer.writerow([row.id, row.service, row.endpoint, row.method, row.status_code,
+                             row.response_time_ms, row.timestamp.isoformat()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
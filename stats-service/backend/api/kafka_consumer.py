@@ -1,28 +1,128 @@
-from kafka import KafkaConsumer
-import json
+from kafka import ConsumerRebalanceListener, KafkaConsumer, OffsetAndMetadata, TopicPartition
+from kafka.consumer.fetcher import ConsumerRecord
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from dataclasses import dataclass, field
+from sqlalchemy.dialects.postgresql import insert
+from typing import Dict, List, Optional, Set, Tuple
 import logging
-from .database import SessionLocal, APIUsage, init_db
+from .database import SessionLocal, APIUsage, APIUsageSummaryReceipt, init_db
+from .rollups import apply_rollups, as_utc_naive
+from .wire import decode_record
 from datetime import datetime
 import os
 import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Producers in aggregate mode send one of these per window instead of an event per request
+SUMMARY_TYPE = 'usage_summary'
+
+USAGE_TOPIC = 'api-usage'
+CONSUMER_GROUP = 'stats-service-group'
+
+# Where ingestion runs: inside the API process, or in separate consumer_runner processes
+EMBEDDED_MODE = 'embedded'
+EXTERNAL_MODE = 'external'
+KAFKA_CONSUMER_MODE = os.getenv('KAFKA_CONSUMER_MODE', EMBEDDED_MODE)
+
+# Lag is refreshed this often, events/s is averaged over the rate window
+KAFKA_LAG_INTERVAL_SECONDS = float(os.getenv('KAFKA_LAG_INTERVAL_SECONDS', '10'))
+RATE_WINDOW_SECONDS = 60
+
+# Unhealthy when the poll loop has not come around for this long
+STALL_SECONDS = 60
+
+def _uuid(value) -> Optional[uuid.UUID]:
+    """Binary batches carry UUIDs already, legacy JSON events strings, older events nothing"""
+    if value is None or isinstance(value, uuid.UUID):
+        return value
+    return uuid.UUID(value)
+
+
+def _timestamp(value) -> datetime:
+    """Naive UTC time of an event, binary batches carry datetimes and legacy JSON events ISO strings"""
+    return as_utc_naive(value if isinstance(value, datetime) else datetime.fromisoformat(value))
+
+
+@dataclass
+class DecodedBatch:
+    """Rows ready to store for one polled batch of records"""
+    rows: List[dict] = field(default_factory=list)
+    rollup_rows: List[dict] = field(default_factory=list)
+    summaries: List[dict] = field(default_factory=list)
+    duplicates: int = 0
+
+
+@dataclass
+class WriteResult:
+    events: int
+    summaries: int
+    duplicates: int
+    elapsed_ms: float
+
+
+class _RebalanceListener(ConsumerRebalanceListener):
+    def __init__(self, owner: "StatsKafkaConsumer"):
+        self.owner = owner
+
+    def on_partitions_revoked(self, revoked):
+        self.owner._on_partitions_revoked(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        self.owner._on_partitions_assigned(assigned)
+
+
 class StatsKafkaConsumer:
+    """Stores api-usage records in batches, decoding the next batch while the previous one is written
+
+    Any number of these can run in the consumer group, each owning some of the
+    topic's partitions. Offsets are committed only after their batch is committed
+    to the database.
+    """
+
     def __init__(self):
         kafka_server_endpoint = os.getenv('KAFKA_SERVER_ENDPOINT', 'localhost:9092')
         kafka_api_key = os.getenv('KAFKA_API_KEY')
         kafka_api_secret = os.getenv('KAFKA_API_SECRET')
+        self.max_batch_size = int(os.getenv('KAFKA_MAX_BATCH_SIZE', '1000'))
+        self.max_batch_wait_ms = int(os.getenv('KAFKA_MAX_BATCH_WAIT_MS', '500'))
+        self.retry_backoff_seconds = float(os.getenv('KAFKA_RETRY_BACKOFF_SECONDS', '2'))
         self.running = False
         self.consumer_thread = None
+
+        # Only touched by the consumer thread, the Kafka client is not thread safe
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Optional[Tuple[List[ConsumerRecord], Future]] = None
+        self._revoked: Set[TopicPartition] = set()
+        self._committed: Dict[TopicPartition, int] = {}
+        self._next_lag_update = 0.0
+
+        # Counters, read by stats() from other threads
+        self._stats_lock = threading.Lock()
+        self._rate_samples: deque = deque()
+        self._lag: Dict[TopicPartition, dict] = {}
+        self.events_stored = 0
+        self.summaries_stored = 0
+        self.duplicates_skipped = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.rebalances = 0
+        self.last_batch_ms = 0.0
+        self.max_batch_ms = 0.0
+        self.last_poll_at: Optional[float] = None
         
         try:
             consumer_config = {
                 'bootstrap_servers': [kafka_server_endpoint],
-                'value_deserializer': lambda m: json.loads(m.decode('utf-8')),
-                'group_id': 'stats-service-group',
+                # Values are decoded per batch according to their format header
+                'group_id': CONSUMER_GROUP,
                 'auto_offset_reset': 'earliest',
-                'enable_auto_commit': True,
+                # Offsets are committed only after the batch is committed to the database
+                'enable_auto_commit': False,
+                'max_poll_records': self.max_batch_size,
             }
             
             if kafka_api_key and kafka_api_secret:
@@ -34,7 +134,8 @@ class StatsKafkaConsumer:
                 })
                 logger.info("Using SASL authentication for Kafka")
             
-            self.consumer = KafkaConsumer('api-usage', **consumer_config)
+            # Not subscribed yet, a process that never starts consuming must not be handed partitions
+            self.consumer = KafkaConsumer(**consumer_config)
             
             logger.info(f"Kafka consumer connected to {kafka_server_endpoint}")
         except Exception as e:
@@ -48,51 +149,339 @@ class StatsKafkaConsumer:
             return
             
         self.running = True
-        self.consumer_thread = threading.Thread(target=self._consume, daemon=True)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='usage-writer')
+        self.consumer_thread = threading.Thread(target=self._consume, name='kafka-consumer', daemon=True)
         self.consumer_thread.start()
         logger.info("Kafka consumer started")
 
     def _consume(self):
-        """Consume messages and store in database"""
+        """Poll and decode batches, handing each to the writer thread once the previous one is stored"""
         init_db()
-        
-        for message in self.consumer:
-            if not self.running:
+        self.consumer.subscribe([USAGE_TOPIC], listener=_RebalanceListener(self))
+
+        try:
+            while self.running:
+                records = self._poll_batch()
+                self.last_poll_at = time.monotonic()
+                batch = self._decode_batch(records) if records else None
+
+                # Decoding above overlapped with the previous write
+                if not self._finish_write(pending=records):
+                    continue
+
+                if batch is not None:
+                    self._in_flight = (records, self._writer.submit(self._write_batch, batch))
+
+                if time.monotonic() >= self._next_lag_update:
+                    self._update_lag()
+
+            self._finish_write(rewind=False)
+        finally:
+            self._writer.shutdown(wait=True)
+            self.consumer.close()
+
+    def _finish_write(self, pending: List[ConsumerRecord] = (), rewind: bool = True) -> bool:
+        """Wait for the batch being written and commit its offsets
+
+        When the write failed, the failed batch and the pending records polled after
+        it are rewound for redelivery and False is returned.
+        """
+        if self._in_flight is None:
+            return True
+
+        records, future = self._in_flight
+        self._in_flight = None
+        try:
+            result = future.result()
+        except Exception as e:
+            with self._stats_lock:
+                self.failed_batches += 1
+            logger.error(f"Failed to store batch of {len(records)} records, retrying: {e}")
+            if rewind:
+                self._rewind(list(records) + list(pending))
+                time.sleep(self.retry_backoff_seconds)
+            return False
+
+        offsets = self._next_offsets(records)
+        try:
+            self.consumer.commit(offsets)
+            for tp, offset in offsets.items():
+                self._committed[tp] = offset.offset
+        except Exception as e:
+            # The batch is already stored, it may be redelivered after a rebalance
+            logger.warning(f"Failed to commit offsets: {e}")
+
+        now = time.monotonic()
+        with self._stats_lock:
+            self.events_stored += result.events
+            self.summaries_stored += result.summaries
+            self.duplicates_skipped += result.duplicates
+            self.batches += 1
+            self.last_batch_ms = result.elapsed_ms
+            self.max_batch_ms = max(self.max_batch_ms, result.elapsed_ms)
+            self._rate_samples.append((now, result.events))
+            while self._rate_samples and self._rate_samples[0][0] < now - RATE_WINDOW_SECONDS:
+                self._rate_samples.popleft()
+        return True
+
+    def _on_partitions_revoked(self, revoked):
+        """Runs inside poll before partitions move to another consumer
+
+        The batch being written is committed while this consumer still owns its
+        partitions. Records already polled from revoked partitions are dropped,
+        the new owner reads them again from the committed offset.
+        """
+        self._finish_write(rewind=False)
+        self._revoked.update(revoked)
+        with self._stats_lock:
+            for tp in revoked:
+                self._lag.pop(tp, None)
+        for tp in revoked:
+            self._committed.pop(tp, None)
+        logger.info(f"Partitions revoked: {sorted(tp.partition for tp in revoked)}")
+
+    def _on_partitions_assigned(self, assigned):
+        with self._stats_lock:
+            self.rebalances += 1
+        self._next_lag_update = 0.0
+        logger.info(f"Partitions assigned: {sorted(tp.partition for tp in assigned)}")
+
+    def _poll_batch(self) -> List[ConsumerRecord]:
+        """Collect up to max_batch_size records, waiting at most max_batch_wait_ms"""
+        records = []
+        deadline = time.monotonic() + self.max_batch_wait_ms / 1000
+
+        while self.running and len(records) < self.max_batch_size:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
                 break
-                
+
+            polled = self.consumer.poll(
+                timeout_ms=remaining_ms,
+                max_records=self.max_batch_size - len(records),
+            )
+            if self._revoked:
+                # A rebalance ran inside this poll, what it returned is already from the new assignment
+                records = [r for r in records if TopicPartition(r.topic, r.partition) not in self._revoked]
+                self._revoked.clear()
+            for partition_records in polled.values():
+                records.extend(partition_records)
+
+        return records
+
+    def _update_lag(self):
+        """Records behind the high watermark of each assigned partition, from the last committed offset"""
+        self._next_lag_update = time.monotonic() + KAFKA_LAG_INTERVAL_SECONDS
+        lag = {}
+        for tp in self.consumer.assignment():
+            committed = self._committed.get(tp)
+            if committed is None:
+                try:
+                    committed = self.consumer.committed(tp)
+                except Exception as e:
+                    logger.warning(f"Failed to read committed offset of partition {tp.partition}: {e}")
+                if committed is not None:
+                    self._committed[tp] = committed
+
+            # Known once the partition has been fetched from
+            highwater = self.consumer.highwater(tp)
+            lag[tp] = {
+                "topic": tp.topic,
+                "partition": tp.partition,
+                "committed": committed,
+                "highwater": highwater,
+                "lag": max(highwater - (committed or 0), 0) if highwater is not None else None,
+            }
+
+        with self._stats_lock:
+            self._lag = lag
+
+    def _next_offsets(self, records: List[ConsumerRecord]) -> Dict[TopicPartition, OffsetAndMetadata]:
+        """Offsets to commit so consumption resumes after the last record of each partition"""
+        offsets = {}
+        for record in records:
+            tp = TopicPartition(record.topic, record.partition)
+            if tp not in offsets or record.offset + 1 > offsets[tp].offset:
+                offsets[tp] = OffsetAndMetadata(record.offset + 1, None)
+        return offsets
+
+    def _rewind(self, records: List[ConsumerRecord]):
+        """Seek back to the first record of each partition so a failed batch is redelivered"""
+        first_offsets = {}
+        for record in records:
+            tp = TopicPartition(record.topic, record.partition)
+            first_offsets[tp] = min(first_offsets.get(tp, record.offset), record.offset)
+
+        for tp, offset in first_offsets.items():
+            self.consumer.seek(tp, offset)
+
+    def _to_row(self, event: dict) -> dict:
+        return {
+            "event_id": _uuid(event.get('event_id')),
+            "service": event.get('service'),
+            "endpoint": event.get('endpoint'),
+            "method": event.get('method'),
+            "status_code": event.get('status_code'),
+            "response_time_ms": event.get('response_time_ms'),
+            "timestamp": _timestamp(event.get('timestamp')),
+            "user_agent": event.get('user_agent'),
+            "query_params": event.get('query_params'),
+            "sampled": bool(event.get('sampled')),
+        }
+
+    def _to_summary(self, event: dict) -> dict:
+        return {
+            "summary_id": _uuid(event.get('summary_id')),
+            "service": event.get('service'),
+            "window_start": _timestamp(event['window_start']),
+            "groups": [
+                {
+                    **group,
+                    "count": int(group['count']),
+                    # JSON object keys are strings
+                    "bins": {int(index): int(count) for index, count in (group.get('bins') or {}).items()},
+                }
+                for group in event['groups']
+            ],
+        }
+
+    def _decode_batch(self, records: List[ConsumerRecord]) -> DecodedBatch:
+        """Decode a batch of usage events and summaries into rows
+
+        Sampled events are stored raw for debugging but kept out of the rollups,
+        the summary of their window already counts them.
+        """
+        batch = DecodedBatch()
+        seen = set()
+        for record in records:
             try:
-                event = message.value
-                self._store_usage_event(event)
+                messages = decode_record(record.value, record.headers)
             except Exception as e:
-                logger.error(f"Error processing message: {e}")
+                # A malformed record must not block the rest of the partition
+                logger.error(f"Skipping undecodable usage record at offset {record.offset}: {e}")
+                continue
+
+            for event in messages:
+                try:
+                    if event.get('type') == SUMMARY_TYPE:
+                        summary = self._to_summary(event)
+                        item_id = summary["summary_id"]
+                    else:
+                        row = self._to_row(event)
+                        item_id = row["event_id"]
+
+                    # Kafka producer retries can put the same message in one batch twice
+                    if item_id is not None:
+                        if item_id in seen:
+                            batch.duplicates += 1
+                            continue
+                        seen.add(item_id)
+
+                    if event.get('type') == SUMMARY_TYPE:
+                        batch.summaries.append(summary)
+                        continue
+
+                    batch.rows.append(row)
+                    if not row["sampled"]:
+                        batch.rollup_rows.append(row)
+                except Exception as e:
+                    logger.error(f"Skipping malformed usage event at offset {record.offset}: {e}")
+
+        return batch
+
+    def _write_batch(self, batch: DecodedBatch) -> WriteResult:
+        """Store decoded rows and their rollups in PostgreSQL in one transaction, on the writer thread
+
+        Events and summaries already stored by an earlier delivery are skipped, and only
+        what is new this time is added to the rollups, so redelivered batches are harmless.
+        """
+        start = time.perf_counter()
+        if not batch.rows and not batch.summaries:
+            return WriteResult(0, 0, batch.duplicates, 0.0)
 
-    def _store_usage_event(self, event: dict):
-        """Store usage event in PostgreSQL"""
         db = SessionLocal()
         try:
-            usage = APIUsage(
-                service=event.get('service'),
-                endpoint=event.get('endpoint'),
-                method=event.get('method'),
-                status_code=event.get('status_code'),
-                response_time_ms=event.get('response_time_ms'),
-                timestamp=datetime.fromisoformat(event.get('timestamp')),
-                user_agent=event.get('user_agent'),
-                query_params=event.get('query_params')
-            )
-            db.add(usage)
+            rollup_rows = batch.rollup_rows
+            inserted = 0
+            if batch.rows:
+                stmt = insert(APIUsage).on_conflict_do_nothing(
+                    index_elements=['event_id', 'timestamp']
+                ).returning(APIUsage.event_id)
+                new_ids = db.execute(stmt, batch.rows).scalars().all()
+                inserted = len(new_ids)
+                if inserted < len(batch.rows):
+                    # Rows without an id never conflict, so they are always new
+                    new_ids = set(new_ids)
+                    rollup_rows = [row for row in rollup_rows if row["event_id"] is None or row["event_id"] in new_ids]
+
+            summaries = self._new_summaries(db, batch.summaries)
+            apply_rollups(db, rollup_rows, summaries)
             db.commit()
-            logger.debug(f"Stored usage event for {event.get('endpoint')}")
-        except Exception as e:
-            logger.error(f"Failed to store usage event: {e}")
+            logger.debug(f"Stored {inserted} usage events and {len(summaries)} summaries")
+        except Exception:
             db.rollback()
+            raise
         finally:
             db.close()
 
+        duplicates = batch.duplicates + len(batch.rows) - inserted + len(batch.summaries) - len(summaries)
+        return WriteResult(inserted, len(summaries), duplicates, (time.perf_counter() - start) * 1000)
+
+    def _new_summaries(self, db, summaries: List[dict]) -> List[dict]:
+        """Record summary ids, keeping only summaries that were not merged before"""
+        receipts = [
+            {"summary_id": summary["summary_id"], "window_start": summary["window_start"]}
+            for summary in summaries if summary["summary_id"] is not None
+        ]
+        if not receipts:
+            return summaries
+
+        stmt = insert(APIUsageSummaryReceipt).on_conflict_do_nothing(
+            index_elements=['summary_id']
+        ).returning(APIUsageSummaryReceipt.summary_id)
+        new_ids = set(db.execute(stmt, receipts).scalars().all())
+        return [summary for summary in summaries if summary["summary_id"] is None or summary["summary_id"] in new_ids]
+
+    def healthy(self) -> bool:
+        """Consuming and not stuck, a slow database shows up as a stalled poll loop"""
+        if not self.running or self.consumer_thread is None or not self.consumer_thread.is_alive():
+            return False
+        return self.last_poll_at is None or time.monotonic() - self.last_poll_at < STALL_SECONDS
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._stats_lock:
+            recent = [(at, count) for at, count in self._rate_samples if at >= now - RATE_WINDOW_SECONDS]
+            partitions = sorted(self._lag.values(), key=lambda p: (p["topic"], p["partition"]))
+            counters = {
+                "events_stored": self.events_stored,
+                "summaries_stored": self.summaries_stored,
+                "duplicates_skipped": self.duplicates_skipped,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "rebalances": self.rebalances,
+                "last_batch_ms": round(self.last_batch_ms, 2),
+                "max_batch_ms": round(self.max_batch_ms, 2),
+            }
+
+        return {
+            "mode": KAFKA_CONSUMER_MODE,
+            "group": CONSUMER_GROUP,
+            "running": self.running,
+            "healthy": self.healthy(),
+            "partitions": partitions,
+            "total_lag": sum(p["lag"] or 0 for p in partitions),
+            "events_per_second": round(sum(count for _, count in recent) / RATE_WINDOW_SECONDS, 2),
+            **counters,
+        }
+
     def stop(self):
         """Stop the consumer"""
         self.running = False
-        if self.consumer:
+        if self.consumer_thread:
+            # The consumer thread closes the consumer once its current batch is done
+            self.consumer_thread.join(timeout=self.max_batch_wait_ms / 1000 + 10)
+        elif self.consumer:
             self.consumer.close()
         logger.info("Kafka consumer stopped")
 
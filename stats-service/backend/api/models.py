@@ -22,6 +22,12 @@ class User(BaseModel):
     hashed_password: str
     role: Role
 
+class Principal(BaseModel):
+    """Authenticated identity, safe to cache across requests"""
+    id: int
+    username: str
+    role: Role
+
 class UserRegister(BaseModel):
     username: str
     password: str
@@ -0,0 +1,269 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+from sqlalchemy import delete, text
+from sqlalchemy.engine import Connection
+from .database import engine, Base, APIUsage, APIUsageSummaryReceipt
+import argparse
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Partition Configuration
+USAGE_PARTITION_DAYS_AHEAD = int(os.getenv('USAGE_PARTITION_DAYS_AHEAD', '7'))
+# Days of raw events to keep, 0 keeps everything. Rollups and latency sketches are not affected.
+USAGE_RETENTION_DAYS = int(os.getenv('USAGE_RETENTION_DAYS', '0'))
+# Summary ids only need to outlive the topic's retention, after that nothing can be redelivered
+SUMMARY_RECEIPT_RETENTION_DAYS = int(os.getenv('SUMMARY_RECEIPT_RETENTION_DAYS', '7'))
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv('PARTITION_MAINTENANCE_INTERVAL_SECONDS', '3600'))
+
+PARENT_TABLE = APIUsage.__tablename__
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+PARTITION_PATTERN = re.compile(rf"^{PARENT_TABLE}_p(\d{{8}})$")
+
+# Serializes maintenance between API and consumer processes, the holder is the maintenance leader
+MAINTENANCE_LOCK_ID = 5201_0001
+
+
+def utc_today() -> date:
+    """Partition days are UTC days, like the timestamps stored in them"""
+    return datetime.now(timezone.utc).date()
+
+
+def partition_name(day: date) -> str:
+    return f"{PARENT_TABLE}_p{day:%Y%m%d}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass(:table))"
+        ),
+        {"table": PARENT_TABLE},
+    ).scalar()
+
+
+def list_partitions(conn: Connection) -> List[date]:
+    """Days that currently have their own partition"""
+    names = conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(:table)"
+        ),
+        {"table": PARENT_TABLE},
+    ).scalars()
+
+    days = []
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            days.append(datetime.strptime(match.group(1), "%Y%m%d").date())
+    return sorted(days)
+
+
+def create_partition(conn: Connection, day: date) -> None:
+    """Create one day's partition, moving that day's rows out of the default partition first.
+
+    Postgres refuses to create a partition while the default partition holds rows of its
+    range, which happens when maintenance did not run for a while.
+    """
+    name = partition_name(day)
+    bounds = f"FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+    in_range = f"timestamp >= '{day.isoformat()}' AND timestamp < '{(day + timedelta(days=1)).isoformat()}'"
+
+    has_default = conn.execute(text("SELECT to_regclass(:table)"), {"table": DEFAULT_PARTITION}).scalar()
+    if has_default is not None:
+        # Keeps new rows of the day from landing in the default partition during the move
+        conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE"))
+        stranded = conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})")).scalar()
+        if stranded:
+            conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+            moved = conn.execute(text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            )).rowcount
+            conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+            logger.info(f"Created partition {name} with {moved} rows from {DEFAULT_PARTITION}")
+            return
+
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} FOR VALUES {bounds}"))
+    logger.info(f"Created partition {name}")
+
+
+def create_partitions(conn: Connection, first_day: date, last_day: date) -> None:
+    """Create daily partitions for every day in [first_day, last_day] that does not have one"""
+    existing = set(list_partitions(conn))
+
+    day = first_day
+    while day <= last_day:
+        if day not in existing:
+            try:
+                # One failed day must not stop the others or startup
+                with conn.begin_nested():
+                    create_partition(conn, day)
+            except Exception as e:
+                logger.error(f"Could not create partition {partition_name(day)}: {e}")
+        day += timedelta(days=1)
+
+
+def drop_expired_partitions(conn: Connection, retention_days: int) -> None:
+    """Drop whole partitions older than the retention window instead of deleting rows"""
+    if retention_days <= 0:
+        return
+
+    cutoff = utc_today() - timedelta(days=retention_days)
+    for day in list_partitions(conn):
+        if day < cutoff:
+            conn.execute(text(f"DROP TABLE IF EXISTS {partition_name(day)}"))
+            logger.info(f"Dropped expired partition {partition_name(day)}")
+
+
+def prune_summary_receipts(conn: Connection, retention_days: int = SUMMARY_RECEIPT_RETENTION_DAYS) -> None:
+    """Forget summary ids old enough that their summaries can no longer be redelivered"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    conn.execute(delete(APIUsageSummaryReceipt).where(APIUsageSummaryReceipt.received_at < cutoff))
+
+
+def ensure_partitions(
+    days_ahead: int = USAGE_PARTITION_DAYS_AHEAD,
+    retention_days: int = USAGE_RETENTION_DAYS,
+    wait: bool = True,
+) -> bool:
+    """Create upcoming partitions and apply the retention policy.
+
+    Without wait, returns False right away when another process is already maintaining.
+    """
+    with engine.begin() as conn:
+        if wait:
+            conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MAINTENANCE_LOCK_ID})
+        elif not conn.execute(
+            text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": MAINTENANCE_LOCK_ID}
+        ).scalar():
+            return False
+
+        prune_summary_receipts(conn)
+
+        if not is_partitioned(conn):
+            logger.warning(
+                f"{PARENT_TABLE} is not partitioned, run 'python -m api.partitions migrate' to convert it"
+            )
+            return True
+
+        # Rows outside every daily range (clock skew, replays of old events) land here
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"))
+
+        today = utc_today()
+        create_partitions(conn, today - timedelta(days=1), today + timedelta(days=days_ahead))
+        drop_expired_partitions(conn, retention_days)
+    return True
+
+
+def migrate_legacy_table() -> None:
+    """Copy an unpartitioned api_usage table into a new partitioned one, keeping the old table"""
+    legacy_table = f"{PARENT_TABLE}_legacy"
+
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass(:table)"), {"table": PARENT_TABLE}).scalar() is None:
+            print(f"{PARENT_TABLE} does not exist yet, it is created partitioned on startup")
+            return
+
+        if is_partitioned(conn):
+            print(f"{PARENT_TABLE} is already partitioned")
+            return
+
+        # Free every name the partitioned table is about to use
+        conn.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {legacy_table}"))
+        conn.execute(text(f"ALTER TABLE {legacy_table} RENAME CONSTRAINT {PARENT_TABLE}_pkey TO {legacy_table}_pkey"))
+        conn.execute(text(f"ALTER SEQUENCE IF EXISTS {PARENT_TABLE}_id_seq RENAME TO {legacy_table}_id_seq"))
+        conn.execute(text(f"ALTER INDEX IF EXISTS uq_{PARENT_TABLE}_event_id RENAME TO uq_{legacy_table}_event_id"))
+
+        Base.metadata.create_all(bind=conn, tables=[APIUsage.__table__])
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"))
+
+        first_timestamp: Optional[datetime] = conn.execute(
+            text(f"SELECT min(timestamp) FROM {legacy_table}")
+        ).scalar()
+        today = utc_today()
+        first_day = first_timestamp.date() if first_timestamp else today
+        create_partitions(conn, first_day, today + timedelta(days=USAGE_PARTITION_DAYS_AHEAD))
+
+        # The legacy table may predate newer columns such as event_id
+        legacy_columns = set(conn.execute(
+            text("SELECT column_name FROM information_schema.columns WHERE table_name = :table"),
+            {"table": legacy_table},
+        ).scalars())
+        columns = ", ".join(
+            column.name for column in APIUsage.__table__.columns if column.name in legacy_columns
+        )
+        copied = conn.execute(text(
+            f"INSERT INTO {PARENT_TABLE} ({columns}) "
+            f"SELECT {columns} FROM {legacy_table} WHERE timestamp IS NOT NULL"
+        )).rowcount
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{PARENT_TABLE}', 'id'), "
+            f"(SELECT coalesce(max(id), 0) + 1 FROM {PARENT_TABLE}), false)"
+        ))
+
+    print(f"Copied {copied} rows into the partitioned {PARENT_TABLE} table")
+    print(f"Drop {legacy_table} once the new table has been verified")
+
+
+class PartitionMaintainer:
+    """Periodically creates upcoming partitions and drops expired ones.
+
+    Runs in the API and in every consumer process, so partitions keep being created
+    whichever of them are up. A process that finds another one mid-maintenance skips its round.
+    """
+
+    def __init__(self, interval_seconds: int = PARTITION_MAINTENANCE_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._run_now = False
+
+    def start(self, run_now: bool = False):
+        self._stop_event.clear()
+        self._run_now = run_now
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        if self._run_now:
+            self._maintain()
+        while not self._stop_event.wait(self.interval_seconds):
+            self._maintain()
+
+    def _maintain(self):
+        try:
+            if not ensure_partitions(wait=False):
+                logger.debug("Partition maintenance is running in another process")
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the partitioned api_usage table")
+    parser.add_argument("command", choices=["maintain", "migrate"])
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_legacy_table()
+    else:
+        ensure_partitions()
+        print("Partitions are up to date")
+
+
+if __name__ == "__main__":
+    main()
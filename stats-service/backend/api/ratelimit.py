@@ -0,0 +1,93 @@
+from collections import deque, OrderedDict
+from typing import Optional
+from fastapi import HTTPException, Request, status
+import ipaddress
+import math
+import os
+import threading
+import time
+
+# Login throttling configuration
+LOGIN_ATTEMPT_WINDOW_SECONDS = float(os.getenv("LOGIN_ATTEMPT_WINDOW_SECONDS", "60"))
+LOGIN_MAX_ATTEMPTS_PER_USERNAME = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_USERNAME", "10"))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "30"))
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", "10000"))
+# Peers whose X-Real-IP header is believed, by default the nginx running in the same container.
+# Port 8001 is also published directly, where any caller could set the header.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(proxy.strip(), strict=False)
+    for proxy in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+    if proxy.strip()
+]
+
+
+class AttemptThrottle:
+    """Sliding-window attempt limiter per key, tracking at most max_keys keys"""
+
+    def __init__(self, max_attempts: int, window_seconds: float = LOGIN_ATTEMPT_WINDOW_SECONDS,
+                 max_keys: int = THROTTLE_MAX_KEYS):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.throttled = 0
+        self._attempts: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> Optional[float]:
+        """Record an attempt, or return the seconds to wait if the key is over its limit"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            self._attempts.move_to_end(key)
+
+            while attempts and attempts[0] <= now - self.window_seconds:
+                attempts.popleft()
+
+            if len(attempts) >= self.max_attempts:
+                self.throttled += 1
+                return attempts[0] + self.window_seconds - now
+
+            attempts.append(now)
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+            return None
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+username_throttle = AttemptThrottle(LOGIN_MAX_ATTEMPTS_PER_USERNAME)
+ip_throttle = AttemptThrottle(LOGIN_MAX_ATTEMPTS_PER_IP)
+
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> str:
+    """Client address, as reported by X-Real-IP only when the request came through a trusted proxy"""
+    peer = request.client.host if request.client else "unknown"
+    if is_trusted_proxy(peer):
+        return request.headers.get("x-real-ip") or peer
+    return peer
+
+
+def throttle_attempt(request: Request, username: Optional[str] = None) -> None:
+    """Reject an auth attempt with 429 when its IP or username has too many recent attempts"""
+    retry_after = ip_throttle.hit(client_ip(request))
+    if retry_after is None and username is not None:
+        retry_after = username_throttle.hit(username)
+
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, try again later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
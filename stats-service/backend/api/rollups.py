@@ -0,0 +1,353 @@
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import and_, case, cast, delete, func, literal, literal_column, or_, select, Integer, String, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from .database import SessionLocal, APIUsage, APIUsageLatencyBin, APIUsageRollup, APIUsageSummaryReceipt, init_db
+from .sketch import bin_index, LOG_GAMMA, MIN_TRACKED_MS
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rollup granularities, named after the matching PostgreSQL date_trunc fields
+MINUTE = "minute"
+HOUR = "hour"
+DAY = "day"
+GRANULARITIES = (MINUTE, HOUR)
+
+# Latency sketches are kept coarser, day bins keep long-range percentile queries cheap
+SKETCH_GRANULARITIES = (HOUR, DAY)
+
+class SummarizedUsageError(RuntimeError):
+    """Raised when a backfill would replace rollups built from window summaries with their raw sample"""
+
+
+RollupKey = Tuple[str, datetime, str, str, str, str]
+LatencyBinKey = Tuple[str, datetime, str, str, int]
+
+
+def status_class(status_code: Optional[int]) -> str:
+    """Group a status code into its class, e.g. 404 -> '4xx'"""
+    if status_code is None:
+        return "unknown"
+    return f"{status_code // 100}xx"
+
+
+def as_utc_naive(timestamp: datetime) -> datetime:
+    """api_usage and the rollups store naive UTC timestamps, naive input is taken to be UTC already"""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Truncate a timestamp to the start of its bucket"""
+    # Same buckets as date_trunc over the stored UTC timestamps in backfill_rollups
+    timestamp = as_utc_naive(timestamp).replace(second=0, microsecond=0)
+    if granularity in (HOUR, DAY):
+        timestamp = timestamp.replace(minute=0)
+    if granularity == DAY:
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+def _raw_partials(rows: Iterable[dict]) -> Iterator[dict]:
+    """Each raw usage row as a partial aggregate of one request"""
+    for row in rows:
+        response_time = row.get("response_time_ms")
+        bins = {}
+        # Failed requests are reported with a negative response time, they have no latency
+        if response_time is not None and response_time >= 0:
+            bins[bin_index(response_time)] = 1
+        yield {
+            **row,
+            "count": 1,
+            "sum_ms": response_time if response_time is not None else 0.0,
+            "min_ms": response_time,
+            "max_ms": response_time,
+            "bins": bins,
+        }
+
+
+def _summary_partials(summaries: Iterable[dict]) -> Iterator[dict]:
+    """Each group of a producer window summary as a partial aggregate
+
+    Windows divide a minute, so the window start buckets the whole window.
+    """
+    for summary in summaries:
+        for group in summary["groups"]:
+            yield {
+                "timestamp": summary["window_start"],
+                "service": summary.get("service"),
+                "endpoint": group.get("endpoint"),
+                "method": group.get("method"),
+                "status_code": group.get("status_code"),
+                "count": group["count"],
+                "sum_ms": group.get("sum_ms") or 0.0,
+                "min_ms": group.get("min_ms"),
+                "max_ms": group.get("max_ms"),
+                "bins": group.get("bins") or {},
+            }
+
+
+def aggregate_rows(rows: Iterable[dict], summaries: Iterable[dict] = ()) -> List[dict]:
+    """Fold raw usage rows and window summaries into one rollup row per bucket and dimension"""
+    rollups: Dict[RollupKey, dict] = {}
+
+    for row in chain(_raw_partials(rows), _summary_partials(summaries)):
+        for granularity in GRANULARITIES:
+            key = (
+                granularity,
+                bucket_start(row["timestamp"], granularity),
+                row.get("service") or "",
+                row.get("endpoint") or "",
+                row.get("method") or "",
+                status_class(row.get("status_code")),
+            )
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = rollups[key] = {
+                    "granularity": key[0],
+                    "bucket_start": key[1],
+                    "service": key[2],
+                    "endpoint": key[3],
+                    "method": key[4],
+                    "status_class": key[5],
+                    "request_count": 0,
+                    "response_time_sum_ms": 0.0,
+                    "response_time_min_ms": None,
+                    "response_time_max_ms": None,
+                }
+
+            rollup["request_count"] += row["count"]
+            rollup["response_time_sum_ms"] += row["sum_ms"]
+            if row["min_ms"] is not None:
+                if rollup["response_time_min_ms"] is None or row["min_ms"] < rollup["response_time_min_ms"]:
+                    rollup["response_time_min_ms"] = row["min_ms"]
+            if row["max_ms"] is not None:
+                if rollup["response_time_max_ms"] is None or row["max_ms"] > rollup["response_time_max_ms"]:
+                    rollup["response_time_max_ms"] = row["max_ms"]
+
+    # Upsert in key order so concurrent writers always lock rows in the same order
+    return [rollups[key] for key in sorted(rollups)]
+
+
+def aggregate_latency_bins(rows: Iterable[dict], summaries: Iterable[dict] = ()) -> List[dict]:
+    """Count raw usage rows and summary bins per latency sketch bin, bucket and endpoint"""
+    counts: Dict[LatencyBinKey, int] = {}
+
+    for row in chain(_raw_partials(rows), _summary_partials(summaries)):
+        for index, count in row["bins"].items():
+            for granularity in SKETCH_GRANULARITIES:
+                key = (
+                    granularity,
+                    bucket_start(row["timestamp"], granularity),
+                    row.get("service") or "",
+                    row.get("endpoint") or "",
+                    index,
+                )
+                counts[key] = counts.get(key, 0) + count
+
+    return [
+        {
+            "granularity": key[0],
+            "bucket_start": key[1],
+            "service": key[2],
+            "endpoint": key[3],
+            "bin": key[4],
+            "count": counts[key],
+        }
+        for key in sorted(counts)
+    ]
+
+
+def apply_rollups(db: Session, rows: Iterable[dict], summaries: Iterable[dict] = ()) -> None:
+    """Merge a batch of raw usage rows and window summaries into the rollup and sketch tables,
+    inside the caller's transaction"""
+    rows, summaries = list(rows), list(summaries)
+    apply_latency_bins(db, rows, summaries)
+
+    rollups = aggregate_rows(rows, summaries)
+    if not rollups:
+        return
+
+    stmt = insert(APIUsageRollup).values(rollups)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_api_usage_rollups_bucket",
+        set_={
+            "request_count": APIUsageRollup.request_count + stmt.excluded.request_count,
+            "response_time_sum_ms": APIUsageRollup.response_time_sum_ms + stmt.excluded.response_time_sum_ms,
+            "response_time_min_ms": func.least(APIUsageRollup.response_time_min_ms, stmt.excluded.response_time_min_ms),
+            "response_time_max_ms": func.greatest(APIUsageRollup.response_time_max_ms, stmt.excluded.response_time_max_ms),
+        },
+    )
+    db.execute(stmt)
+
+
+def apply_latency_bins(db: Session, rows: Iterable[dict], summaries: Iterable[dict] = ()) -> None:
+    bins = aggregate_latency_bins(rows, summaries)
+    if not bins:
+        return
+
+    stmt = insert(APIUsageLatencyBin).values(bins)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_api_usage_latency_bins_bucket",
+        set_={"count": APIUsageLatencyBin.count + stmt.excluded.count},
+    )
+    db.execute(stmt)
+
+
+def _bucket_range(granularity: str, start: Optional[datetime], end: Optional[datetime]):
+    conditions = [APIUsageLatencyBin.granularity == granularity]
+    if start is not None:
+        conditions.append(APIUsageLatencyBin.bucket_start >= start)
+    if end is not None:
+        conditions.append(APIUsageLatencyBin.bucket_start < end)
+    return and_(*conditions)
+
+
+def latency_bin_range(start: Optional[datetime], end: Optional[datetime], hourly: bool = False):
+    """Filter covering [start, end) with day bins for whole days and hour bins for partial days
+
+    Days are UTC days, the same as the stored day bins.
+    """
+    start = as_utc_naive(start) if start is not None else None
+    end = as_utc_naive(end) if end is not None else None
+    if hourly:
+        return _bucket_range(HOUR, start, end)
+
+    day_start = None
+    if start is not None:
+        day_start = bucket_start(start, DAY)
+        if day_start < start:
+            day_start += timedelta(days=1)
+    day_end = bucket_start(end, DAY) if end is not None else None
+
+    if day_start is not None and day_end is not None and day_start >= day_end:
+        return _bucket_range(HOUR, start, end)
+
+    conditions = [_bucket_range(DAY, day_start, day_end)]
+    if start is not None and day_start > start:
+        conditions.append(_bucket_range(HOUR, start, day_start))
+    if end is not None and day_end < end:
+        conditions.append(_bucket_range(HOUR, day_end, end))
+    return or_(*conditions)
+
+
+def ensure_no_summaries(db: Session) -> None:
+    """Refuse a rebuild from api_usage once aggregate mode producers have contributed to the rollups
+
+    Window summaries are never stored raw, api_usage only holds their sampled events.
+    Receipts are pruned after a while, the sampled flag lasts as long as the events do.
+    """
+    receipt = db.execute(select(APIUsageSummaryReceipt.summary_id).limit(1)).first()
+    sampled = db.execute(select(APIUsage.id).where(APIUsage.sampled).limit(1)).first()
+    if receipt is not None or sampled is not None:
+        raise SummarizedUsageError(
+            "api_usage holds sampled events of aggregate mode producers, rebuilding the rollups "
+            "from it would replace their exact window summaries with the sample"
+        )
+
+
+def backfill_rollups(db: Session) -> None:
+    """Rebuild every rollup and latency sketch from the raw api_usage table in one transaction
+
+    Only valid while producers send raw events, SummarizedUsageError is raised otherwise.
+    """
+    # Block consumer upserts until the rebuilt rollups are committed, locking in the order the consumer writes
+    db.execute(text("LOCK TABLE api_usage_latency_bins, api_usage_rollups IN EXCLUSIVE MODE"))
+    # Checked under the lock, a summary merged from now on waits for this transaction
+    ensure_no_summaries(db)
+    db.execute(delete(APIUsageRollup))
+    db.execute(delete(APIUsageLatencyBin))
+
+    status = case(
+        (APIUsage.status_code.is_(None), literal("unknown")),
+        else_=cast(APIUsage.status_code // 100, String) + literal("xx"),
+    )
+
+    for granularity in GRANULARITIES:
+        bucket = func.date_trunc(literal_column(f"'{granularity}'"), APIUsage.timestamp)
+        service = func.coalesce(APIUsage.service, "")
+        endpoint = func.coalesce(APIUsage.endpoint, "")
+        method = func.coalesce(APIUsage.method, "")
+
+        rollups = select(
+            literal(granularity),
+            bucket,
+            service,
+            endpoint,
+            method,
+            status,
+            func.count(),
+            func.coalesce(func.sum(APIUsage.response_time_ms), 0),
+            func.min(APIUsage.response_time_ms),
+            func.max(APIUsage.response_time_ms),
+        ).group_by(bucket, service, endpoint, method, status)
+
+        db.execute(
+            insert(APIUsageRollup).from_select(
+                [
+                    "granularity", "bucket_start", "service", "endpoint", "method", "status_class",
+                    "request_count", "response_time_sum_ms", "response_time_min_ms", "response_time_max_ms",
+                ],
+                rollups,
+            )
+        )
+
+    # Same mapping as sketch.bin_index, evaluated in the database
+    latency_bin = cast(
+        func.ceil(func.ln(func.greatest(APIUsage.response_time_ms, MIN_TRACKED_MS)) / LOG_GAMMA),
+        Integer,
+    )
+
+    for granularity in SKETCH_GRANULARITIES:
+        bucket = func.date_trunc(literal_column(f"'{granularity}'"), APIUsage.timestamp)
+        service = func.coalesce(APIUsage.service, "")
+        endpoint = func.coalesce(APIUsage.endpoint, "")
+
+        bins = select(
+            literal(granularity),
+            bucket,
+            service,
+            endpoint,
+            latency_bin,
+            func.count(),
+        ).where(
+            APIUsage.response_time_ms >= 0
+        ).group_by(bucket, service, endpoint, latency_bin)
+
+        db.execute(
+            insert(APIUsageLatencyBin).from_select(
+                ["granularity", "bucket_start", "service", "endpoint", "bin", "count"],
+                bins,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the api_usage rollup and latency sketch tables")
+    parser.add_argument("command", choices=["backfill"])
+    parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        backfill_rollups(db)
+        db.commit()
+        print("Rollups and latency sketches rebuilt from api_usage")
+    except SummarizedUsageError as e:
+        db.rollback()
+        print(f"Backfill refused: {e}")
+        raise SystemExit(1)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
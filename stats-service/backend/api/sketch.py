@@ -0,0 +1,64 @@
+from typing import Dict, Optional
+import math
+
+# Logarithmically sized bins (DDSketch) give every quantile estimate a bounded relative error.
+# The bin mapping is part of the stored data, changing it requires rebuilding the bins.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Latencies below this (including 0 ms) share the lowest bin
+MIN_TRACKED_MS = 0.001
+
+PERCENTILES = {"p50": 0.50, "p90": 0.90, "p95": 0.95, "p99": 0.99}
+
+
+def bin_index(value: float) -> int:
+    """Map a latency to the index of the bin containing it"""
+    return math.ceil(math.log(max(value, MIN_TRACKED_MS)) / LOG_GAMMA)
+
+
+def bin_value(index: int) -> float:
+    """Representative latency of a bin, within RELATIVE_ACCURACY of any value in it"""
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class LatencySketch:
+    """Mergeable quantile sketch made of counts per logarithmic bin."""
+
+    def __init__(self, bins: Optional[Dict[int, int]] = None) -> None:
+        self.bins: Dict[int, int] = dict(bins or {})
+        self.count = sum(self.bins.values())
+
+    def add(self, value: float, count: int = 1) -> None:
+        self.add_bin(bin_index(value), count)
+
+    def add_bin(self, index: int, count: int) -> None:
+        self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+
+    def merge(self, other: "LatencySketch") -> None:
+        for index, count in other.bins.items():
+            self.add_bin(index, count)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the q-th quantile, or None if the sketch is empty"""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return bin_value(index)
+
+        return bin_value(max(self.bins))
+
+    def percentiles(self) -> Dict[str, Optional[float]]:
+        percentiles = {}
+        for name, q in PERCENTILES.items():
+            value = self.quantile(q)
+            percentiles[name] = round(value, 2) if value is not None else None
+        return percentiles
+
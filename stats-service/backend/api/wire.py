@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+import json
+import msgpack
+import uuid
+
+# Kafka header naming the encoding of an api-usage record. Records without it are
+# legacy single JSON events or summaries.
+FORMAT_HEADER = 'usage-format'
+MSGPACK_BATCH_V1 = b'msgpack-batch/1'
+MSGPACK_BATCH_V2 = b'msgpack-batch/2'
+
+
+class UnsupportedFormatError(ValueError):
+    pass
+
+
+def record_format(headers: Optional[Sequence[Tuple[str, bytes]]]) -> Optional[bytes]:
+    for key, value in headers or ():
+        if key == FORMAT_HEADER:
+            return value
+    return None
+
+
+def decode_record(value: bytes, headers: Optional[Sequence[Tuple[str, bytes]]]) -> List[dict]:
+    """Usage events and summaries carried by one Kafka record"""
+    wire_format = record_format(headers)
+    if wire_format is None:
+        return [json.loads(value)]
+    if wire_format in (MSGPACK_BATCH_V1, MSGPACK_BATCH_V2):
+        return _decode_batch(msgpack.unpackb(value))
+    raise UnsupportedFormatError(f"Unsupported usage record format {wire_format!r}")
+
+
+def _decode_batch(batch: dict) -> List[dict]:
+    """Expand a batch, see _encode_batch in the f1 service for the layout
+
+    Version 2 appends the event id to each event, otherwise the versions are the same.
+    """
+    strings = batch["str"]
+    service = batch["s"]
+    base_ms = batch["t0"]
+
+    messages = []
+    for endpoint, method, status_code, response_time, offset_ms, user_agent, query_params, sampled, *rest in batch["e"]:
+        event = {
+            "event_id": uuid.UUID(bytes=rest[0]) if rest else None,
+            "service": service,
+            "endpoint": strings[endpoint],
+            "method": strings[method],
+            "status_code": status_code,
+            "response_time_ms": response_time,
+            # Epoch milliseconds become aware UTC datetimes, stored as naive UTC by the consumer
+            "timestamp": datetime.fromtimestamp((base_ms + offset_ms) / 1000, timezone.utc),
+            "user_agent": strings[user_agent] if user_agent is not None else None,
+            "query_params": query_params,
+        }
+        if sampled:
+            event["sampled"] = True
+        messages.append(event)
+
+    messages.extend(batch["sum"])
+    return messages